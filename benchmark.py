@@ -0,0 +1,414 @@
+# Benchmark suite for the protocol, config and display hot paths. Results are printed as JSON, so that runs of
+# different commits can be compared:
+#
+#   python benchmark.py > before.json
+#   python benchmark.py --quick
+#   python benchmark.py --replay approach.cap
+#
+# The benchmarks run without a Raspberry Pi, the panel hardware is replaced by the simulated GPIO and SPI backend of
+# panel.simhw. The SPI device counts the transactions and bytes written to the displays.
+import argparse
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import time
+
+
+# selects the simulated hardware backend and returns the simulated GPIO
+def simulatedHardware():
+	from panel import hardware
+	if hardware.backend is None:
+		hardware.select(hardware.SIM)
+	return hardware.GPIO._module
+
+
+# returns the best time per call in microseconds out of <repeat> runs of <number> calls
+def measure(func, number, repeat=5):
+	best = None
+	for r in range(repeat):
+		start = time.perf_counter()
+		for i in range(number):
+			func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best / number * 1e6
+
+
+# socket which swallows all datagrams
+class NullSocket:
+	def __init__(self):
+		self.sent = 0
+
+	def sendto(self, data, addr):
+		self.sent += len(data)
+
+
+# writer which sends immediately, so that setValue measures conversion and packing
+class ImmediateWriter:
+	def __init__(self, send):
+		self.send = send
+
+	def write(self, dataref, value, rate=None, origin=None):
+		self.send(dataref, value)
+
+
+# builds a config object with a synthetic profile of <n> variables
+def syntheticConfig(n):
+	from panel.config import config
+	lines = ["[Variables]"]
+	lines += ["var{0}=sim/bench/var{0}".format(i) for i in range(n)]
+	lines += ["[Requests]"]
+	lines += ["var{0}=sim/bench/var{0}".format(i) for i in range(n)]
+	for i in range(n):
+		lines += ["[Var.var{}]".format(i), "type=linear", "offset=0.0", "slope=100.0", "range_in_min=0.0", "range_in_max=1000.0"]
+	cfg = config()
+	cfg.loadString("\n".join(lines))
+	return cfg
+
+
+# builds an offline xplane connection and returns it together with a client for <cfg>
+def offlineXPlane(cfg, batch=False):
+	from panel.xplane import xplane
+	xp = xplane(batch=batch, hostfile=None, sock=NullSocket())
+	xp.writer = ImmediateWriter(xp._sendValue)
+	return xp, xp.connect(cfg)
+
+
+# RREF decode plus _parse throughput. The same number of values is also decoded from DATA packets, 8 values per group
+def benchRref(sizes, number):
+	from panel.batch import BatchDecoder
+	from panel.store import dataKey
+	results = {}
+	modes = [False]
+	if BatchDecoder.available():
+		modes.append(True)
+	for kind in ("rref", "data"):
+		for n in sizes:
+			for batch in modes:
+				cfg = syntheticConfig(n)
+				xp, client = offlineXPlane(cfg, batch)
+				hits = [0]
+				def cbk(var, val):
+					hits[0] += 1
+				for i, (var, dataref) in enumerate(cfg.getRequests().items()):
+					xp.store.add(var, dataref if kind == "rref" else dataKey(i // 8, i % 8), cfg.getCodec(var), cbk)
+				# two packets with all values changed, sent alternately
+				packets = []
+				for k in range(2):
+					if kind == "rref":
+						packet = bytearray(b"RREF,")
+						for idx in range(n):
+							packet += struct.pack("<if", idx, float(1000 * k + idx))
+					else:
+						packet = bytearray(b"DATA*")
+						for group in range((n + 7) // 8):
+							packet += struct.pack("<i8f", group, *[float(1000 * k + group * 8 + i) for i in range(8)])
+					packets.append(packet)
+				views = [memoryview(p) for p in packets]
+				state = [0]
+				def step():
+					k = state[0] = state[0] ^ 1
+					retvalues = {}
+					xp._decode(packets[k], views[k], len(packets[k]), retvalues)
+					if retvalues:
+						xp._parse(retvalues.items())
+					if xp.batch is not None:
+						xp._dispatch(xp.batch.changes())
+				us = measure(step, number)
+				name = "{}_{}".format("numpy" if batch else "python", n)
+				if kind == "data":
+					name = "data_" + name
+				results[name] = {
+					"us_per_packet": round(us, 3),
+					"us_per_value": round(us / n, 4),
+					"values_per_s": round(n / us * 1e6),
+				}
+	return results
+
+
+# setValue and _sendValue cost per variable type
+def benchEncode(number):
+	from panel.config import config
+	cfg = config()
+	cfg.loadString("""
+[Variables]
+v_bool=sim/bench/bool
+v_float=sim/bench/float
+v_enum=sim/bench/enum
+v_linear=sim/bench/linear
+[Var.v_bool]
+type=bool
+[Var.v_float]
+type=float
+[Var.v_enum]
+type=enum
+map=States
+[Var.v_linear]
+type=linear
+offset=0.0
+slope=100.0
+range_in_min=118.0
+range_in_max=136.9
+[Map.States]
+Off=0
+On=1
+Test=2
+""")
+	xp, client = offlineXPlane(cfg)
+	values = {"bool": 1, "float": 12.5, "enum": "On", "linear": 121.5}
+	results = {}
+	for t, value in values.items():
+		var = "v_" + t
+		results[t] = {"us_per_setValue": round(measure(lambda: client.setValue(var, value), number), 3)}
+	results["_sendValue"] = {"us_per_call": round(measure(lambda: xp._sendValue("sim/bench/linear", 12150.0), number), 3)}
+	return results
+
+
+# config.load and profile switching
+def benchConfig(number):
+	from panel.config import config
+	results = {}
+	devnull = open(os.devnull, "w")
+	stdout = sys.stdout
+	try:
+		sys.stdout = devnull
+		def load():
+			config().load("config/xplane.cfg")
+		results["load"] = {"us_per_call": round(measure(load, number), 1)}
+		cfg = config()
+		cfg.load("config/xplane.cfg")
+		switches = {}
+		for k in range(number):
+			for i in range(cfg.getNumberOfProfiles()):
+				start = time.perf_counter()
+				cfg.nextProfile()
+				elapsed = time.perf_counter() - start
+				name = cfg.profiles["Default"]["Active"]
+				switches[name] = min(switches.get(name, elapsed), elapsed)
+		for name, elapsed in switches.items():
+			results["switch_to_" + name] = {"us_per_switch": round(elapsed * 1e6, 1)}
+	finally:
+		sys.stdout = stdout
+		devnull.close()
+	return results
+
+
+# Radio.render cost with a display which counts the SPI traffic
+def benchRender(number):
+	simulatedHardware()
+	import panel.radio as radio_module
+	from panel.radio import Radio
+
+	devnull = open(os.devnull, "w")
+	stdout = sys.stdout
+	results = {}
+	try:
+		sys.stdout = devnull
+		radio_module.xplane = OfflineXPlane
+		radio = Radio()
+		radio.keyboard.stop()
+		# render synchronously, without the scheduler thread
+		radio.renderer.stop()
+		radio.OnOffChanged(True)
+		spi = radio.display.lcd.spi
+		for name, mode in (("VHF1", Radio.MODE_COM1), ("ILS", Radio.MODE_NAV1), ("HF1", Radio.MODE_HF1), ("ADF", Radio.MODE_ADF2)):
+			radio.Mode = mode
+			radio.render()
+			# "unchanged" redraws the same state, "changed" toggles the standby frequency before each redraw
+			key = radio.getStandbyFrequencyKey()
+			freqs = (radio.frequencies[key], radio.frequencies[key] + 1.0)
+			state = [0]
+			def change():
+				state[0] ^= 1
+				radio.frequencies[key] = freqs[state[0]]
+				radio.render()
+			results[name] = {}
+			for case, func in (("unchanged", radio.render), ("changed", change)):
+				spi.reset()
+				func()
+				transactions, nbytes = spi.transactions, spi.bytes
+				us = measure(func, number)
+				results[name][case] = {"us_per_update": round(us, 2), "spi_transactions_per_update": transactions, "spi_bytes_per_update": nbytes}
+		results["glyph_cache"] = radio.display.glyphs.stats()
+		radio.stop()
+	finally:
+		sys.stdout = stdout
+		devnull.close()
+	return results
+
+
+# Latency of the complete Radio stack from a simulated input edge to the SPI write which shows its effect, with the
+# event bus and render scheduler threads running
+def benchLatency(number):
+	gpio = simulatedHardware()
+	import panel.radio as radio_module
+	from panel.radio import Radio
+	from panel.metrics import registry
+
+	devnull = open(os.devnull, "w")
+	stdout = sys.stdout
+	results = {}
+	try:
+		sys.stdout = devnull
+		radio_module.xplane = OfflineXPlane
+		radio = Radio()
+		spi = radio.display.lcd.spi
+		clock = gpio.clock
+		# switch the panel on
+		gpio.toggle(radio.OnOff.pin)
+		clock.advance(0.1)
+		time.sleep(0.1)
+		radio.setMode(Radio.MODE_COM1)
+		time.sleep(0.1)
+		encoder = radio.encoder
+		registry.reset()
+		samples = []
+		for i in range(number):
+			# one detent in alternating directions, slow enough for no acceleration. The pause lets the frame rate cap
+			# expire, so that the sample measures the event path and not the wait for the next frame
+			time.sleep(radio.renderer.interval)
+			before = spi.transactions
+			gpio.turn(encoder.ENC_A, encoder.ENC_B, 1 if i % 2 == 0 else -1, 0.004)
+			start = time.perf_counter()
+			clock.advance(1.0)
+			if spi.waitFor(before, 1.0) > before:
+				samples.append(time.perf_counter() - start)
+		samples.sort()
+		results["encoder_to_spi"] = {
+			"samples": len(samples),
+			"median_ms": round(samples[len(samples) // 2] * 1e3, 3) if samples else None,
+			"max_ms": round(samples[-1] * 1e3, 3) if samples else None,
+			"bus_dropped": radio.bus.dropped,
+			"frames": radio.renderer.frames,
+		}
+		# the same path as seen by the runtime histograms of the panel
+		results["histograms"] = registry.snapshot()["histograms"]
+		radio.stop()
+	finally:
+		sys.stdout = stdout
+		devnull.close()
+	return results
+
+
+# Decode and dispatch cost of a recorded session (main.py --capture). The datagrams received from x-plane are fed into
+# an offline connection subscribed to the default profile, as fast as possible
+def benchReplay(path, number):
+	from panel.batch import BatchDecoder
+	from panel.capture import Replay, XPLANE
+	from panel.config import config
+	devnull = open(os.devnull, "w")
+	stdout = sys.stdout
+	results = {}
+	try:
+		sys.stdout = devnull
+		cfg = config()
+		cfg.load("config/xplane.cfg")
+		replay = Replay(path)
+		modes = [False]
+		if BatchDecoder.available():
+			modes.append(True)
+		for batch in modes:
+			xp, client = offlineXPlane(cfg, batch)
+			hits = [0]
+			def cbk(var, val):
+				hits[0] += 1
+			client.startReceiver({var: cbk for var in cfg.getSubscriptions()})
+			packets = [data for (timestamp, source, data) in replay.packets(xp.store) if source == XPLANE]
+			if not packets:
+				break
+			values = xp.store.values
+			def run():
+				# every run starts from unknown values, so that all runs dispatch the same changes
+				for i in range(len(values)):
+					values[i] = float("nan")
+				for data in packets:
+					xp.feed(data)
+			hits[0] = 0
+			run()
+			dispatched = hits[0]
+			us = measure(run, number)
+			results["numpy" if batch else "python"] = {
+				"datagrams": len(packets),
+				"values_dispatched": dispatched,
+				"us_per_datagram": round(us / len(packets), 3),
+				"us_per_replay": round(us, 1),
+			}
+	finally:
+		sys.stdout = stdout
+		devnull.close()
+	return results
+
+
+# xplane connection stand-in without sockets and threads for the Radio benchmarks, which is its own client
+class OfflineXPlane:
+	def __init__(self, dbg=0, *args, **kwargs):
+		pass
+	def connect(self, cfg):
+		return self
+	def start(self):
+		pass
+	def stop(self):
+		pass
+	def startReceiver(self, callbacks=None):
+		pass
+	def stopReceiver(self):
+		pass
+	def switchProfile(self, callbacks=None):
+		pass
+	def setFocus(self, variables):
+		pass
+	def setValue(self, var, value, origin=None):
+		pass
+	def command(self, action, values=None):
+		return False
+
+
+def commitId():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks for the A320Panel hot paths, results are printed as JSON")
+	parser.add_argument("--quick", action="store_true", help="fewer iterations, for a fast sanity check")
+	parser.add_argument("--only", choices=("rref", "encode", "config", "render", "latency", "replay"), action="append", help="run only the given benchmark, may be repeated")
+	parser.add_argument("--replay", metavar="CAPTURE", help="also replay the given capture file (main.py --capture)")
+	args = parser.parse_args(argv)
+	if args.replay:
+		args.replay = os.path.abspath(args.replay)
+	# the config files are referenced relative to the repository root
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	scale = 10 if args.quick else 1
+	only = args.only or ("rref", "encode", "config", "render", "latency", "replay")
+	results = {}
+	if "rref" in only:
+		results["rref"] = benchRref((10, 100, 1000), 2000 // scale)
+	if "encode" in only:
+		results["encode"] = benchEncode(20000 // scale)
+	if "config" in only:
+		results["config"] = benchConfig(200 // scale)
+	if "render" in only:
+		results["render"] = benchRender(2000 // scale)
+	if "latency" in only:
+		results["latency"] = benchLatency(200 // scale)
+	if "replay" in only and args.replay:
+		results["replay"] = benchReplay(args.replay, 50 // scale)
+	report = {
+		"commit": commitId(),
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"results": results,
+	}
+	json.dump(report, sys.stdout, indent=2)
+	print ()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,24 +1,78 @@
+from panel import hardware
+from panel.capture import CaptureWriter
+from panel.metrics import MetricsServer, StatsWriter
 from panel.radio import Radio
+from panel.xplane import xplane
+import argparse
 import time
 
 
+parser = argparse.ArgumentParser(description="A320 radio panel for X-Plane")
+# --sim runs the panel with simulated GPIO and SPI devices instead of the Raspberry Pi hardware
+parser.add_argument("--sim", action="store_true", help="use simulated GPIO and SPI devices")
+# --asyncio runs the whole panel on a single event loop instead of one thread per subsystem
+parser.add_argument("--asyncio", action="store_true", help="run all subsystems on one event loop")
+parser.add_argument("--metrics-port", type=int, metavar="PORT", help="serve the runtime metrics as JSON on http://127.0.0.1:PORT/metrics")
+parser.add_argument("--stats-file", metavar="PATH", help="write the runtime metrics as JSON to PATH periodically and on exit")
+parser.add_argument("--capture", metavar="PATH", help="append all datagrams exchanged with x-plane to PATH, see panel/capture.py")
+parser.add_argument("--stats-interval", type=float, default=StatsWriter.DEFAULT_INTERVAL, metavar="SECONDS", help="interval of the stats file updates")
+args = parser.parse_args()
 
+if args.sim:
+	hardware.select(hardware.SIM)
 
-print ("Starting Radio class")
-radio = Radio()
+reporters = []
+if args.metrics_port is not None:
+	reporters.append(MetricsServer(args.metrics_port))
+if args.stats_file:
+	reporters.append(StatsWriter(args.stats_file, args.stats_interval))
+for reporter in reporters:
+	reporter.start()
 
-cont = True
+# with a capture the connection is created here, so that it records from the first request on
+capture = None
+connection = None
+if args.capture:
+	capture = CaptureWriter(args.capture)
+	connection = xplane(capture=capture)
 
-while cont == True:
+if args.asyncio:
+	from panel.runtime import Runtime
+	runtime = Runtime()
+	print ("Starting Radio class")
+	radio = Radio(runtime=runtime, connection=connection)
 	try:
-		cont = True
-		time.sleep(1)
+		runtime.run()
 	except KeyboardInterrupt:
 		print ("quitting...")
-		cont = False
+	radio.stop()
+	if connection is not None:
+		connection.stop()
+	runtime.close()
+else:
+	print ("Starting Radio class")
+	if connection is not None:
+		connection.start()
+	radio = Radio(connection=connection)
 
+	cont = True
 
-radio.stop()
+	while cont == True:
+		try:
+			cont = True
+			time.sleep(1)
+		except KeyboardInterrupt:
+			print ("quitting...")
+			cont = False
+
+
+	radio.stop()
+	if connection is not None:
+		connection.stop()
+if capture is not None:
+	capture.close()
+for reporter in reporters:
+	reporter.stop()
 print ("Thread terminated !")
 
 
@@ -0,0 +1,130 @@
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+
+# numpy layout of a single RREF record
+RREF_DTYPE = [('idx', '<i4'), ('val', '<f4')]
+# numpy layout of a single DATA record: the data group and its 8 values
+DATA_DTYPE = [('group', '<i4'), ('val', '<f4', (8,))]
+
+
+# This class decodes complete RREF packets at once using numpy. Incoming values are compared against the previous values
+# as a vector and only the changed entries are converted and handed back to python. It requires numpy, use <available> to check.
+class BatchDecoder:
+
+	def __init__(self, store):
+		if numpy is None:
+			raise ImportError("BatchDecoder requires numpy")
+		self.store = store
+		self.generation = None
+		self._rebuild()
+
+	# returns True if numpy could be imported
+	@staticmethod
+	def available():
+		return numpy is not None
+
+	# INTERNAL FUNCTION
+	# Builds the vectors for the previous values and the linear transformation of each slot from the store
+	def _rebuild(self):
+		store = self.store
+		size = len(store)
+		self.values = numpy.array(store.values, dtype=numpy.float32)
+		self.used = numpy.zeros(size, dtype=bool)
+		self.linear = numpy.zeros(size, dtype=bool)
+		self.offset = numpy.zeros(size, dtype=numpy.float64)
+		self.slope = numpy.ones(size, dtype=numpy.float64)
+		self.range_min = numpy.full(size, -numpy.inf)
+		self.range_max = numpy.full(size, numpy.inf)
+		for idx, codec in enumerate(store.codecs):
+			self.used[idx] = store.datarefs[idx] is not None
+			if codec is None:
+				continue
+			if codec.type == "linear":
+				self.linear[idx] = True
+				self.offset[idx] = codec.offset
+				self.slope[idx] = codec.slope
+				self.range_min[idx] = codec.range_min
+				self.range_max[idx] = codec.range_max
+			elif codec.type == "float":
+				self.linear[idx] = True
+		self.dirty = numpy.zeros(size, dtype=bool)
+		# slot of each value of each data group, -1 for the values which are not stored
+		table = store.dataTable()
+		self.groups = numpy.full((max(table, default=-1) + 1, 8), -1, dtype=numpy.int32)
+		for group, slots in table.items():
+			self.groups[group] = [-1 if idx is None else idx for idx in slots]
+		self.generation = store.generation
+
+	# Decodes the RREF datagram of <nbytes> length in <view> and marks all changed slots. Values for unknown indices are dropped.
+	def feed(self, view, nbytes):
+		if self.generation != self.store.generation:
+			self._rebuild()
+		count = (nbytes - 5) // 8
+		if count <= 0:
+			return
+		rec = numpy.frombuffer(view, dtype=RREF_DTYPE, count=count, offset=5)
+		self._update(rec['idx'], rec['val'])
+
+	# Decodes the DATA datagram of <nbytes> length in <view> and marks all changed slots. Groups and values which are not
+	# stored are dropped.
+	def feedData(self, view, nbytes):
+		if self.generation != self.store.generation:
+			self._rebuild()
+		count = (nbytes - 5) // 36
+		if count <= 0:
+			return
+		rec = numpy.frombuffer(view, dtype=DATA_DTYPE, count=count, offset=5)
+		group = rec['group']
+		known = (group >= 0) & (group < len(self.groups))
+		if not known.all():
+			rec = rec[known]
+			group = group[known]
+		idx = self.groups[group].ravel()
+		val = rec['val'].ravel()
+		known = idx >= 0
+		self._update(idx[known], val[known])
+
+	# INTERNAL FUNCTION
+	# Stores the values <val> received for the slots <idx> and marks the changed ones
+	def _update(self, idx, val):
+		known = (idx >= 0) & (idx < len(self.values))
+		if not known.all():
+			idx = idx[known]
+			val = val[known]
+		known = self.used[idx]
+		if not known.all():
+			idx = idx[known]
+			val = val[known]
+		if len(idx) > 1:
+			# a slot may occur several times, only its last value counts like in the scalar decoder. unique returns the
+			# first occurrence, so it is applied to the reversed arrays
+			idx, last = numpy.unique(idx[::-1], return_index=True)
+			val = val[::-1][last]
+		changed = self.values[idx] != val
+		idx = idx[changed]
+		self.values[idx] = val[changed]
+		self.dirty[idx] = True
+
+	# Returns a list of (index, raw value, logical value) tuples for all slots changed since the last call and writes the new raw
+	# values back into the store. Linear and float variables are converted as a vector, all other types by their codec.
+	def changes(self):
+		idx = numpy.flatnonzero(self.dirty)
+		if len(idx) == 0:
+			return []
+		self.dirty[idx] = False
+		raw = self.values[idx].astype(numpy.float64)
+		logical = numpy.clip((raw - self.offset[idx]) / self.slope[idx], self.range_min[idx], self.range_max[idx])
+		linear = self.linear[idx]
+		store = self.store
+		result = []
+		for i, r, l, lin in zip(idx.tolist(), raw.tolist(), logical.tolist(), linear.tolist()):
+			store.values[i] = r
+			if not lin:
+				codec = store.codecs[i]
+				l = codec.decode(r) if codec is not None else None
+			result.append((i, r, l))
+		return result
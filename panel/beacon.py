@@ -1,13 +1,16 @@
 import socket
 import threading
 import struct
+from panel.capture import IN, BEACON
 
 # THis class will listen for the beacon, which is broadcasted from each x-plane instance on the local network
 class XPlaneBeaconListener(threading.Thread):
 	SEARCHING = 1
 	LISTENING = 2
-	def __init__(self, dbg=0):
+	# received beacons are written to <capture>, a panel.capture.CaptureWriter, if one is given
+	def __init__(self, dbg=0, capture=None):
 		self.dbg=dbg
+		self.capture = capture
 		#i initialize threading
 		threading.Thread.__init__(self)
 		self.active = True
@@ -40,21 +43,30 @@ class XPlaneBeaconListener(threading.Thread):
 	def registerChangeEvent(self, cbk):
 		self.callback.append(cbk)
 
+	# handles a single message received on the beacon socket
+	def handleMessage(self, msg):
+		if self.capture is not None:
+			self.capture.record(IN, BEACON, msg)
+		if msg[0:5] != b"BECN\x00":
+			print ("Unknown message received !")
+		else:
+			if self.dbg >=1:
+				print ("Beacon received, checking the data provided")
+			(maj, min, host, ver, role, port) = struct.unpack("<BBiiIH", msg[5:21])
+			sdta = msg[21:].split(b'\0')
+			host_name=sdta[0]
+			moved = self.state == self.LISTENING and self.host != (host_name, port)
+			self.host = (host_name, port)
+			if not self.changeState(self.LISTENING) and moved:
+				# another x-plane instance is announced, the listeners move to it
+				for func in self.callback:
+					func(self.state, self.host)
+
 	def run(self):
 		while self.active == True:
 			try:
 				msg, addr = self.sock.recvfrom(1024)
-
-				if msg[0:5] != b"BECN\x00":
-					print ("Unknown message received !")
-				else:
-					if self.dbg >=1:
-						print ("Beacon received, checking the data provided")
-					(maj, min, host, ver, role, port) = struct.unpack("<BBiiIH", msg[5:21])
-					sdta = msg[21:].split(b'\0')
-					host_name=sdta[0]
-					self.host = (host_name, port)
-					self.changeState(self.LISTENING)
+				self.handleMessage(msg)
 			except socket.timeout:
 				self.changeState(self.SEARCHING)
 		self.sock.close()
@@ -0,0 +1,188 @@
+import argparse
+import struct
+import threading
+import time
+
+
+# direction of a captured datagram
+IN = 1			# received from x-plane
+OUT = 2			# sent to x-plane
+MARK = 3		# start of a capture session, its timestamp is the time base of the following records
+
+# socket a datagram has been seen on
+XPLANE = 1		# the data socket (RREF, DREF, DATA, ...)
+BEACON = 2		# the multicast beacon socket
+
+MAGIC = b"XPCAP\x01\x00\x00"
+# record header: monotonic timestamp in seconds, direction, source and length of the datagram which follows
+RECORD = struct.Struct("<dBBH")
+
+
+# Writes every datagram of the x-plane and beacon sockets to a compact append-only file. Each record is the 12 byte
+# header followed by the datagram as it has been sent or received. Several sessions may be appended to the same file,
+# each one starts with a MARK record. The file is flushed once per second and when it is closed.
+class CaptureWriter:
+	FLUSH_INTERVAL = 1.0
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.file = open(path, "ab")
+		if self.file.tell() == 0:
+			self.file.write(MAGIC)
+		self.flushed = time.monotonic()
+		self.records = 0
+		self.record(MARK, 0, b"")
+
+	# EXPORTED FUNCTION
+	# Appends the datagram <data> (bytes or memoryview) seen in <direction> on the socket <source>
+	def record(self, direction, source, data):
+		now = time.monotonic()
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(RECORD.pack(now, direction, source, len(data)))
+			self.file.write(data)
+			self.records += 1
+			if now - self.flushed >= self.FLUSH_INTERVAL:
+				self.file.flush()
+				self.flushed = now
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+
+# EXPORTED FUNCTION
+# Reads a capture file and yields (timestamp, direction, source, data) for each record. The timestamps are made relative
+# to the start of the session they belong to. A truncated last record, e.g. of a panel which has been killed, is ignored
+def readCapture(path):
+	with open(path, "rb") as f:
+		data = f.read()
+	if not data.startswith(MAGIC):
+		raise ValueError("{} is not a capture file".format(path))
+	pos = len(MAGIC)
+	base = 0.0
+	while pos + RECORD.size <= len(data):
+		(timestamp, direction, source, length) = RECORD.unpack_from(data, pos)
+		pos += RECORD.size
+		if pos + length > len(data):
+			break
+		if direction == MARK:
+			base = timestamp
+		yield (timestamp - base, direction, source, data[pos:pos + length])
+		pos += length
+
+
+# This class feeds a capture back into an xplane connection, which handles the datagrams as if they had been received
+# from x-plane. The RREF indices of the capture are translated to the slots the datarefs have in the store of the
+# connection, using the RREF requests recorded in the capture, so the panels have to subscribe before the replay starts.
+#
+#	replay = Replay("approach.cap")
+#	replay.play(connection, speed=None)		# as fast as possible
+class Replay:
+	RREF_REQUEST = struct.Struct("<5sii400s")
+
+	def __init__(self, path):
+		self.path = path
+		self.records = list(readCapture(path))
+
+	# EXPORTED FUNCTION
+	# Returns the received datagrams as a list of (timestamp, source, data). The RREF packets of the x-plane socket are
+	# rewritten for the slots of <store>, values of datarefs which are not stored keep their captured index
+	def packets(self, store=None):
+		packets = []
+		captured = {}
+		offset = 0.0
+		last = 0.0
+		for (timestamp, direction, source, data) in self.records:
+			# sessions are played one after the other
+			if direction == MARK:
+				offset = last
+			timestamp += offset
+			last = timestamp
+			if source != XPLANE:
+				if direction == IN:
+					packets.append((timestamp, source, data))
+			elif direction == OUT:
+				if data.startswith(b"RREF\x00") and len(data) == self.RREF_REQUEST.size:
+					(cmd, freq, idx, string) = self.RREF_REQUEST.unpack(data)
+					if freq > 0:
+						captured[idx] = string.split(b"\x00")[0].decode("utf-8")
+					else:
+						captured.pop(idx, None)
+			elif direction == IN:
+				if store is not None and data.startswith(b"RREF"):
+					data = self._translate(data, captured, store)
+				packets.append((timestamp, source, data))
+		return packets
+
+	# INTERNAL FUNCTION
+	# Rewrites the indices of an RREF packet
+	def _translate(self, data, captured, store):
+		out = bytearray(data[:5])
+		count = (len(data) - 5) // 8
+		for idx, fval in struct.iter_unpack("<if", data[5:5 + count*8]):
+			dataref = captured.get(idx)
+			if dataref is not None:
+				slot = store.find(dataref)
+				if slot is not None:
+					idx = slot
+			out += struct.pack("<if", idx, fval)
+		return bytes(out)
+
+	# EXPORTED FUNCTION
+	# Feeds the capture into the connection <xp>. <speed> scales the original timing, 2.0 plays twice as fast, None plays
+	# as fast as possible. Beacons are only replayed with <beacons>, as they make the connection send requests to the
+	# captured host. Returns the number of datagrams and the elapsed time
+	def play(self, xp, speed=1.0, beacons=False):
+		packets = self.packets(xp.store)
+		count = 0
+		start = time.monotonic()
+		for (timestamp, source, data) in packets:
+			if speed:
+				delay = start + timestamp / speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			if source == XPLANE:
+				xp.feed(data)
+			elif beacons:
+				xp.beacon.handleMessage(data)
+			else:
+				continue
+			count += 1
+		return {"datagrams": count, "elapsed": time.monotonic() - start}
+
+
+# EXPORTED FUNCTION
+# Returns a summary of a capture file
+def summary(path):
+	stats = {"sessions": 0, "duration": 0.0}
+	for (timestamp, direction, source, data) in readCapture(path):
+		if direction == MARK:
+			stats["sessions"] += 1
+			continue
+		key = "{}_{}".format("in" if direction == IN else "out", "beacon" if source == BEACON else data[0:4].decode("ascii", "replace"))
+		(packets, nbytes) = stats.get(key, (0, 0))
+		stats[key] = (packets + 1, nbytes + len(data))
+		stats["duration"] = max(stats["duration"], timestamp)
+	return stats
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Shows the contents of X-Plane UDP capture files")
+	parser.add_argument("files", nargs="+", help="capture files written with main.py --capture")
+	args = parser.parse_args(argv)
+	for path in args.files:
+		print (path)
+		for key, value in summary(path).items():
+			if isinstance(value, tuple):
+				print ("  {:<16s} {:8d} packets {:10d} bytes".format(key, value[0], value[1]))
+			else:
+				print ("  {:<16s} {}".format(key, round(value, 3)))
+
+
+if __name__ == "__main__":
+	main()
@@ -1,16 +1,214 @@
+import argparse
+import hashlib
+import marshal
+import os
+import sys
 from configparser import ConfigParser
+from configparser import Error as ParserError
+from types import MappingProxyType
+from panel.store import DATA_VALUES, dataKey
+
+
+# Raised when a profile cannot be read or contains invalid variable definitions
+class ConfigError(ValueError):
+    pass
+
+
+# Immutable, precompiled description of a single logical variable. It is built once per profile from the
+# 'Var.<name>' section and holds everything the receive and send paths need, so that converting a value
+# is pure arithmetic or a dict lookup without going back to the ConfigParser.
+class Codec:
+    __slots__ = ("name", "type", "dataref", "request", "offset", "slope", "range_min", "range_max",
+                 "increment_lo", "increment_hi", "max_rate", "rate", "focus_rate", "acceleration", "forward", "reverse")
+
+    def __init__(self, name, section, maps, dataref=None, request=None):
+        _set = object.__setattr__
+        _set(self, "name", name)
+        _set(self, "type", section.get("type"))
+        if self.type not in ("bool", "float", "enum", "linear"):
+            raise ValueError('Variable {} has unknown type {}'.format(name, self.type))
+        _set(self, "dataref", dataref)
+        _set(self, "request", request)
+        _set(self, "offset", float(section.get("offset", 0.0)))
+        _set(self, "slope", float(section.get("slope", 1.0)))
+        _set(self, "range_min", float(section.get("range_in_min", "-inf")))
+        _set(self, "range_max", float(section.get("range_in_max", "inf")))
+        _set(self, "increment_lo", float(section.get("increment_lo", 0.0)))
+        _set(self, "increment_hi", float(section.get("increment_hi", 0.0)))
+        # maximum rate in Hz at which the variable is sent to x-plane, 0 selects the default rate
+        _set(self, "max_rate", float(section.get("max_rate", 0.0)))
+        # RREF rates in Hz while the variable is not shown and while it is shown on the panel, None selects the default
+        _set(self, "rate", int(section["rate"]) if "rate" in section else None)
+        _set(self, "focus_rate", int(section["focus_rate"]) if "focus_rate" in section else None)
+        # acceleration curve as (velocity, multiplier) pairs, sorted by descending velocity
+        curve = []
+        for point in section.get("accel", "").split(","):
+            if point.strip():
+                (velocity, multiplier) = point.split(":")
+                curve.append((float(velocity), float(multiplier)))
+        _set(self, "acceleration", tuple(sorted(curve, reverse=True)))
+        if self.type == "linear":
+            if "slope" not in section:
+                raise ValueError('Variable {} of type linear has no slope'.format(name))
+            if self.slope == 0.0:
+                raise ValueError('Variable {} of type linear has a slope of 0'.format(name))
+        if self.type == "enum":
+            # forward maps the logical state to the x-plane value, reverse maps it back
+            if "map" not in section:
+                raise ValueError('Variable {} of type enum has no map'.format(name))
+            mapname = 'Map.{}'.format(section["map"])
+            if mapname not in maps:
+                raise ValueError('Variable {} refers to the missing section {}'.format(name, mapname))
+            states = maps[mapname]
+            forward = {state: float(val) for state, val in states.items()}
+            reverse = {val: state for state, val in forward.items()}
+        else:
+            forward = {}
+            reverse = {}
+        _set(self, "forward", MappingProxyType(forward))
+        _set(self, "reverse", MappingProxyType(reverse))
+
+    # returns the values of all fields as plain data, so that the codec can be stored in the compiled config cache
+    def state(self):
+        return tuple(dict(value) if isinstance(value, MappingProxyType) else value for value in (getattr(self, key) for key in self.__slots__))
+
+    # builds a codec from the values returned by <state> without parsing the profile again
+    @classmethod
+    def restore(cls, state):
+        codec = object.__new__(cls)
+        for key, value in zip(cls.__slots__, state):
+            if key in ("forward", "reverse"):
+                value = MappingProxyType(value)
+            object.__setattr__(codec, key, value)
+        return codec
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Codec is immutable")
+
+    # returns the step multiplier for the given encoder velocity in detents per second
+    def stepMultiplier(self, velocity):
+        for (v, multiplier) in self.acceleration:
+            if velocity >= v:
+                return multiplier
+        return 1.0
+
+    # converts a value received from x-plane into the logical value. An enum value which is not in the map returns None
+    def decode(self, val):
+        t_type = self.type
+        if t_type == "linear":
+            # y = offs + m*x   ==> x = (y-offs)/m
+            t_val = (val - self.offset) / self.slope
+            if t_val < self.range_min:
+                return self.range_min
+            elif t_val > self.range_max:
+                return self.range_max
+            return t_val
+        elif t_type == "float":
+            return float(val)
+        elif t_type == "bool":
+            return val == 1.0
+        else:
+            return self.reverse.get(val)
+
+    # converts a logical value into the float value to be sent to x-plane
+    def encode(self, value):
+        t_type = self.type
+        if t_type == "linear":
+            value = float(value)
+            if value < self.range_min:
+                value = self.range_min
+            elif value > self.range_max:
+                value = self.range_max
+            return self.offset + self.slope*value
+        elif t_type == "float":
+            return float(value)
+        elif t_type == "bool":
+            if value > 0:
+                return 1.0
+            return 0.0
+        else:
+            # map keys are stored lower case by the ConfigParser, just like it looks them up
+            return self.forward[str(value).lower()]
+
+
+# returns the sections of the given ConfigParser as plain dicts of (interpolated) values
+def sections(parser):
+    return {name: dict(parser[name]) for name in parser.sections()}
+
+
+# compiles the given sections into one Codec per logical variable. All invalid variable definitions are collected and
+# reported together with a ConfigError. Variables without a 'Var.' section cannot be converted and are left out, so they
+# show up as missing codecs instead of failing inside the receive loop.
+def compileSections(cfg, source="<profile>"):
+    codecs = {}
+    errors = []
+    variables = cfg.get("Variables", {})
+    requests = cfg.get("Requests", {})
+    for var, position in cfg.get("Data", {}).items():
+        try:
+            parseDataPosition(position)
+        except ValueError as e:
+            errors.append('[Data] Variable {}: {}'.format(var, e))
+    for var in dict.fromkeys(list(variables.keys()) + list(requests.keys()) + list(cfg.get("Data", {}).keys())):
+        section = 'Var.{}'.format(var)
+        if section not in cfg:
+            print ('No section {} found, variable {} will be ignored'.format(section, var))
+            continue
+        try:
+            codecs[var] = Codec(var, cfg[section], cfg, variables.get(var), requests.get(var))
+        except ValueError as e:
+            errors.append('[{}] {}'.format(section, e))
+    for action, command in cfg.get("Commands", {}).items():
+        if not command.strip():
+            errors.append('[Commands] Action {} has no command'.format(action))
+        elif len(command.encode("utf-8")) >= 500:
+            errors.append('[Commands] Command {} of action {} is too long'.format(command, action))
+    if errors:
+        raise ConfigError('{} is invalid:\n  {}'.format(source, '\n  '.join(errors)))
+    return codecs
+
+
+# returns (group, index) of a position in the DATA output given as <group>:<index>
+def parseDataPosition(position):
+    parts = position.split(":")
+    if len(parts) != 2 or not parts[0].strip().isdigit() or not parts[1].strip().isdigit():
+        raise ValueError('{} is not a <group>:<index> position'.format(position))
+    (group, index) = (int(parts[0]), int(parts[1]))
+    if index >= DATA_VALUES:
+        raise ValueError('index {} is out of range, a data group has {} values'.format(index, DATA_VALUES))
+    return (group, index)
+
+
+# returns the sources the logical variables of the given sections are received from: the dataref of the 'Requests'
+# section or, for variables listed in the 'Data' section, the key of their value in the DATA output
+def subscriptions(cfg):
+    sources = dict(cfg.get("Requests", {}))
+    for var, position in cfg.get("Data", {}).items():
+        sources[var] = dataKey(*parseDataPosition(position))
+    return sources
 
 
 class config:
+    # compiled profiles are cached in this directory next to the profile files
+    CACHE_DIR = "__cfgcache__"
+    # must be incremented whenever the layout of the cache or of the Codec, compileSections or its validation rules
+    # change, as a cached profile is neither compiled nor validated again
+    CACHE_VERSION = 4
 
     def __init__(self):
 		# Initialize the config file parser
         self.profiles = ConfigParser()
-        self.cfg = ConfigParser()
+        # sections of the active profile as plain dicts
+        self.cfg = {}
         # Prepare the internal variables
         self.Profiles = []
         self.Types = []
         self.Variables = []
+        self.codecs = {}
+        # logical variable -> dataref or DATA key it is received from, see subscriptions
+        self.subscriptions = {}
+        # profile name -> (parser, codecs) of every profile listed in the main config file, parsed once by load
+        self.cache = {}
 
     # loads the configuration file with the given path and filename
     def load(self, filename):
@@ -20,23 +218,112 @@ class config:
             print ("Reading config file " + filename)
             self.profiles.read(filename)
             print ('{} has {} profiles'.format(filename, self.getNumberOfProfiles()))
-            activeProfile = self.profiles["Default"]["Active"]
-            filename=self.profiles[activeProfile]["filename"]
-            print ('Loading profile {} from file {}'.format(activeProfile, filename))
-            self.cfg.read('config/{}'.format(filename))
+            self.preload()
+            self.activate(self.profiles["Default"]["Active"])
+        except ConfigError as e:
+            print (e)
+            return False
         except:
             return False
         return True
 
+    # parses and compiles all profiles listed in the 'Profiles' section, so that switching profiles needs no disk access
+    def preload(self):
+        self.cache = {}
+        for profile in self.profiles["Profiles"].values():
+            filename = self.profiles[profile]["filename"]
+            print ('Loading profile {} from file {}'.format(profile, filename))
+            self.cache[profile] = self.readProfile('config/{}'.format(filename))
+
+    # parses the given profile text, e.g. for tests and benchmarks, and makes it the active profile
+    def loadString(self, text):
+        parser = ConfigParser()
+        parser.read_string(text)
+        self.cfg = sections(parser)
+        self.compile()
+
+    # returns the sections and codecs of the given profile file. The compiled profile is taken from the cache if the
+    # file has not been modified since, which is checked by modification time and size first and by content hash second.
+    # Otherwise the file is parsed, validated and the cache is rewritten.
+    def readProfile(self, path):
+        cachefile = os.path.join(os.path.dirname(path), self.CACHE_DIR, os.path.basename(path) + ".bin")
+        try:
+            stat = os.stat(path)
+            cached = self._readCache(cachefile)
+            if cached is not None and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                return self._restore(cached)
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise ConfigError('Profile {} cannot be read: {}'.format(path, e))
+        digest = hashlib.sha256(data).hexdigest()
+        if cached is not None and cached["hash"] == digest:
+            # only touched, remember the new modification time
+            cached["mtime"] = stat.st_mtime_ns
+            cached["size"] = stat.st_size
+            self._writeCache(cachefile, cached)
+            return self._restore(cached)
+        parser = ConfigParser()
+        try:
+            parser.read_string(data.decode("utf-8"), source=path)
+        except (ParserError, UnicodeDecodeError) as e:
+            raise ConfigError('Profile {} cannot be parsed: {}'.format(path, e))
+        cfg = sections(parser)
+        codecs = compileSections(cfg, path)
+        self._writeCache(cachefile, {
+            "version": self.CACHE_VERSION,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": digest,
+            "sections": cfg,
+            "codecs": {var: codec.state() for var, codec in codecs.items()},
+        })
+        return (cfg, codecs)
+
+    # INTERNAL FUNCTION
+    # Returns the content of the given cache file or None if it is missing, unreadable or of a different version
+    def _readCache(self, cachefile):
+        try:
+            with open(cachefile, "rb") as f:
+                cached = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if type(cached) is not dict or cached.get("version") != self.CACHE_VERSION:
+            return None
+        return cached
+
+    # INTERNAL FUNCTION
+    # Writes the cache file atomically. A read-only config directory only costs the startup time, so errors are ignored
+    def _writeCache(self, cachefile, cached):
+        try:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            tmpfile = cachefile + ".tmp"
+            with open(tmpfile, "wb") as f:
+                marshal.dump(cached, f)
+            os.replace(tmpfile, cachefile)
+        except OSError:
+            pass
+
+    # INTERNAL FUNCTION
+    def _restore(self, cached):
+        codecs = {var: Codec.restore(state) for var, state in cached["codecs"].items()}
+        return (cached["sections"], codecs)
+
+    # makes the given profile the active one
+    def activate(self, profile):
+        (self.cfg, self.codecs) = self.cache[profile]
+        self.subscriptions = subscriptions(self.cfg)
+        self.profiles["Default"]["Active"] = profile
+
     def getActiveProfileName(self):
         p_name = self.profiles["Default"]["Active"]
-        p_idx = self.profiles["Profiles"].values().index(p_name)
-        p_ID = self.profiles["Profiles"].keys()[p_idx]
+        p_idx = list(self.profiles["Profiles"].values()).index(p_name)
+        p_ID = list(self.profiles["Profiles"].keys())[p_idx]
         return p_ID
 
     def getActiveProfileNum(self):
         p_name = self.profiles["Default"]["Active"]
-        p_idx = self.profiles["Profiles"].values().index(p_name)
+        p_idx = list(self.profiles["Profiles"].values()).index(p_name)
         return p_idx
 
     def nextProfile(self):
@@ -44,24 +331,27 @@ class config:
         p_idx = p_idx + 1
         if p_idx > self.getNumberOfProfiles() - 1:
             p_idx = 0
-        new_profile_name = self.profiles["Profiles"].values()[p_idx]
-        filename = self.profiles[new_profile_name]["filename"]
-        self.profiles["Default"]["Active"] = new_profile_name
-        print ('Loading profile {} from file {}'.format(new_profile_name, filename))
-        self.cfg.clear()
-        self.cfg.read('config/{}'.format(filename))
+        new_profile_name = list(self.profiles["Profiles"].values())[p_idx]
+        print ('Activating profile {}'.format(new_profile_name))
+        self.activate(new_profile_name)
 
     def prevProfile(self):
         p_idx = self.getActiveProfileNum()
         p_idx = p_idx - 1
         if p_idx < 0:
             p_idx = self.getNumberOfProfiles()-1
-        new_profile_name = self.profiles["Profiles"].values()[p_idx]
-        filename = self.profiles[new_profile_name]["filename"]
-        self.profiles["Default"]["Active"] = new_profile_name
-        print ('Loading profile {} from file {}'.format(new_profile_name, filename))
-        self.cfg.clear()
-        self.cfg.read('config/{}'.format(filename))
+        new_profile_name = list(self.profiles["Profiles"].values())[p_idx]
+        print ('Activating profile {}'.format(new_profile_name))
+        self.activate(new_profile_name)
+
+    # compiles the active profile into one immutable Codec per logical variable
+    def compile(self):
+        self.codecs = compileSections(self.cfg)
+        self.subscriptions = subscriptions(self.cfg)
+
+    # returns the precompiled codec for the given variable or None if the variable is unknown
+    def getCodec(self, var):
+        return self.codecs.get(var)
 
     def getNumberOfProfiles(self):
         return self.profiles["Profiles"].keys().__len__()
@@ -70,10 +360,18 @@ class config:
     def getRequests(self):
         return self.cfg["Requests"]
 
+    # returns the sources of all received variables of the active profile: their dataref or their key in the DATA output
+    def getSubscriptions(self):
+        return self.subscriptions
+
     # returns the collection of Variables for the active Profile
     def getVariables(self):
         return self.cfg["Variables"]
 
+    # returns the x-plane command mapped to the given logical action in the active profile or None if it has none
+    def getCommand(self, action):
+        return self.cfg.get("Commands", {}).get(action)
+
     # returns the variable type for the given variable
     def getVariableType(self, var):
         return self.getVariableItem(var, "type")
@@ -88,3 +386,27 @@ class config:
         map = 'Map.{}'.format(mapname)
         return self.cfg[map]
 
+
+# Compiles all profiles of the given main config file into the cache and reports invalid variable definitions, so that
+# config mistakes are found before the flight:  python -m panel.config config/xplane.cfg
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m panel.config", description="Validates and compiles the profiles of a panel configuration")
+    parser.add_argument("filename", nargs="?", default="config/xplane.cfg", help="main config file")
+    args = parser.parse_args(argv)
+    cnf = config()
+    cnf.profiles.read(args.filename)
+    failed = 0
+    directory = os.path.dirname(args.filename)
+    for profile in cnf.profiles["Profiles"].values():
+        path = os.path.join(directory, cnf.profiles[profile]["filename"])
+        try:
+            (cfg, codecs) = cnf.readProfile(path)
+            print ('{}: {} variables ok'.format(path, len(codecs)))
+        except ConfigError as e:
+            print (e)
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,45 @@
+from collections import OrderedDict
 from panel.max7219 import Lcd
 
 
+# Bounded LRU cache from (format string, value) to the rendered segment pattern of the resulting text. Frequencies
+# cycle through a small set of channel values, so most redraws are served from the cache.
+class GlyphCache:
+
+	def __init__(self, lcd, maxsize=256):
+		self.lcd = lcd
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	# returns the segment pattern for the formatted value
+	def get(self, fmt_string, val):
+		key = (fmt_string, val)
+		try:
+			pattern = self.entries[key]
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return pattern
+		except KeyError:
+			pass
+		self.misses += 1
+		pattern = tuple(self.lcd.renderString(fmt_string.format(val))[:8])
+		self.entries[key] = pattern
+		if len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+		return pattern
+
+	# returns the hit and miss counters together with the current size
+	def stats(self):
+		return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+
+
 class Display:
 
 	NONE = 0
@@ -21,8 +60,9 @@ class Display:
 	AM   = 64
 
 	def __init__(self):
-		# Setup 2 LCD displays with each having 6 digits
-		self.lcd = Lcd(400000, 2)
+		# Setup 2 LCD displays with each having 6 digits. Digit changes are collected and written by flush
+		self.lcd = Lcd(400000, 2, autoflush=False)
+		self.glyphs = GlyphCache(self.lcd)
 		self.lcd.setModeAll(Lcd.NORMAL)
 		self.lcd.setIntensityAll(15)
 		self.lcd.setMaxDigits(0,7)
@@ -33,15 +73,16 @@ class Display:
 		self.lcd.setDigitString(1,"------")
 		self.lcd.setDigitValue(0, 6,0)
 		self.lcd.setDigitValue(1, 6,0)
+		self.flush()
 		self.brightness = 1.0
 		self.display1 = Display.NONE
 		self.display2 = Display.NONE
 
 	def setStandbyText(self, fmt_string, val):
-		self.lcd.setDigitString(1, fmt_string.format(val))
+		self.lcd.setDigitValues(1, self.glyphs.get(fmt_string, val))
 
 	def setActiveText(self, fmt_string, val):
-		self.lcd.setDigitString(0, fmt_string.format(val))
+		self.lcd.setDigitValues(0, self.glyphs.get(fmt_string, val))
 
 
 	def clearActiveFrequency(self):
@@ -52,15 +93,19 @@ class Display:
 
 
 	def selectStbyNavMode(self, mode):
-		self.lcd.setDigitValue(0,6,mode, True)
+		self.lcd.setDigitValue(0,6,mode)
 
 	def selectActiveMode(self, mode):
-		self.lcd.setDigitValue(1,6,mode, True)
+		self.lcd.setDigitValue(1,6,mode)
+
+	# Writes all changed digits and LEDs to the displays
+	def flush(self):
+		self.lcd.flush()
 
 	# Brightness shall take a value between 0 and 1 as float. This function will make sure to adjust the right value for the MAX7219
 	def setBrightness(self, b):
-		self.brightness = b
 		self.lcd.setIntensityAll(int(b*15))
+		self.brightness = b
 
 	def enable(self, ena):
 		if ena :
@@ -1,109 +1,210 @@
+import queue
+import threading
 import time
-import RPi.GPIO as GPIO
-
-
-class EventManager:
-	class Event:
-		def __init__(self, functions):
-			if type(functions) is not list:
-				raise ValueError("function parameter shall be a list !")
-			self.functions = functions
-
-		def __iadd__(self, func):
-			self.functions.append(func)
-			return self
-
-		def __isub__(self, func):
-			self.functions.remove(func)
-			return self
-
-		def __call__(self, *args, **kvargs):
-			for func in self.functions : func(*args, **kvargs)
-	@classmethod
-	def addEvent(cls,**kvargs):
-		"""
-		addEvent( event1 = [f1,f2,...], event2 = [g1,g2,...], ... )
-		creates events using **kvargs to create any number of events. Each event recieves a list of functions,
-		where every function in the list recieves the same parameters.
-
-		Example:
-
-		def hello(): print "Hello ",
-		def world(): print "World"
-
-		EventManager.addEvent( salute = [hello] )
-		EventManager.salute += world
-
-		EventManager.salute()
-
-		Output:
-		Hello World
-		"""
-		for key in kvargs.keys():
-			if type(kvargs[key]) is not list:
-				raise ValueError("value has to be a list")
-			else:
-				kvargs[key] = cls.Event(kvargs[key])
-
-		cls.__dict__.update(kvargs)
+from panel.hardware import GPIO, clock
+from panel.metrics import registry
+
+
+# A named event, which calls every registered function with the same parameters
+class Event:
+	def __init__(self, functions):
+		if type(functions) is not list:
+			raise ValueError("function parameter shall be a list !")
+		self.functions = functions
+
+	def __iadd__(self, func):
+		self.functions.append(func)
+		return self
+
+	def __isub__(self, func):
+		self.functions.remove(func)
+		return self
+
+	def __call__(self, *args, **kvargs):
+		for func in self.functions : func(*args, **kvargs)
+
+
+# This class is an event bus with its own dispatcher thread. Producers, e.g. GPIO callbacks, only put a timestamped
+# event on a bounded queue and return immediately. All handlers run on the dispatcher thread, one after the other, so
+# state which is only changed from handlers is changed by a single thread. Events which do not fit into the queue are
+# dropped and counted.
+#
+#	bus = EventBus()
+#	bus.register("salute", hello)
+#	bus.register("salute", world)
+#	bus.start()
+#	bus.post("salute")
+class EventBus(threading.Thread):
+
+	def __init__(self, maxsize=256):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.active = True
+		self.queue = queue.Queue(maxsize)
+		self.events = {}
+		self.dropped = 0
+		# time in seconds between posting and dispatching of the last event
+		self.latency = 0.0
+		# time.monotonic() timestamp at which the event which is being dispatched has been posted
+		self.timestamp = None
+		self.m_events = registry.counter("bus.events")
+		self.m_dropped = registry.counter("bus.dropped")
+		self.m_latency = registry.histogram("latency.bus")
+		self.m_errors = registry.counter("bus.errors")
+
+	# registers <func> for the event with the given name
+	def register(self, name, func):
+		if name not in self.events:
+			self.events[name] = Event([])
+		self.events[name] += func
+
+	# posts the event with the given name. May be called from any thread
+	def post(self, name, *args):
+		self._put((time.monotonic(), name, args))
+
+	# returns a wrapper for <func>, which may be called from any thread and runs <func> on the dispatcher thread
+	def wrap(self, func):
+		def wrapper(*args):
+			self._put((time.monotonic(), func, args))
+		return wrapper
+
+	def _put(self, item):
+		try:
+			self.queue.put_nowait(item)
+		except queue.Full:
+			self.dropped += 1
+			self.m_dropped.add()
+
+	def stop(self):
+		self.active = False
+		# a full queue is drained anyway, the dispatcher stops after the next event
+		try:
+			self.queue.put_nowait(None)
+		except queue.Full:
+			pass
+
+	def run(self):
+		while self.active == True:
+			item = self.queue.get()
+			if item is None:
+				break
+			(timestamp, event, args) = item
+			self.latency = time.monotonic() - timestamp
+			self.timestamp = timestamp
+			self.m_events.add()
+			self.m_latency.observe(self.latency)
+			try:
+				if callable(event):
+					event(*args)
+				elif event in self.events:
+					self.events[event](*args)
+			except Exception as e:
+				# the dispatcher is the only thread running the handlers, a failing handler only loses its own event
+				self.m_errors.add()
+				print ("Event handler {} failed: {!r}".format(getattr(event, "__name__", event), e))
 
 
 class Encoder:
-
-	def __init__(self, CLKPIN, DIRPIN, BTNPIN):
+	# Gray code transition table, indexed by (previous state << 2) | new state, where a state is (A << 1) | B.
+	# A right turn runs through 00 -> 10 -> 11 -> 01 -> 00. Invalid transitions (both pins changed) count as 0
+	TRANSITIONS = (
+		 0, -1, +1,  0,
+		+1,  0,  0, -1,
+		-1,  0,  0, +1,
+		 0, +1, -1,  0,
+	)
+	# a detent is reported when the accumulated transitions reach this count
+	STEPS_PER_DETENT = 4
+	# detents further apart than this (in seconds) reset the velocity
+	VELOCITY_TIMEOUT = 0.5
+	# weight of the newest sample in the smoothed velocity
+	VELOCITY_SMOOTHING = 0.5
+
+	# Events are posted to <bus>. If no bus is given, the encoder creates and starts its own one
+	def __init__(self, CLKPIN, DIRPIN, BTNPIN, steps_per_detent=None, bus=None):
+		if bus is None:
+			bus = EventBus()
+			bus.start()
+		self.bus = bus
 		self.ENC_A = CLKPIN
 		self.ENC_B = DIRPIN
 		self.ENC_BUTTON = BTNPIN
+		self.steps_per_detent = steps_per_detent if steps_per_detent else self.STEPS_PER_DETENT
 		# set either BOARD or BCM mode.
 		GPIO.setmode(GPIO.BCM)
 		# set the three encoder pins as INPUTS with PULL up
 		GPIO.setup(self.ENC_A, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 		GPIO.setup(self.ENC_B, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 		GPIO.setup(self.ENC_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-		GPIO.add_event_detect(self.ENC_A, GPIO.BOTH, callback=self.pinChanged, bouncetime=50)
-		GPIO.add_event_detect(self.ENC_B, GPIO.BOTH, callback=self.pinChanged, bouncetime=50)
+		# quadrature decoder state. Contact bounce shows up as transitions back and forth which cancel each other out,
+		# so the encoder pins must not use the bouncetime of RPi.GPIO, which would drop real edges at higher speeds
+		self.state = (GPIO.input(self.ENC_A) << 1) | GPIO.input(self.ENC_B)
+		self.steps = 0
+		self.last_detent = 0.0
+		self.last_direction = 0
+		self.velocity = 0.0
+		self.m_detents = registry.counter("encoder.detents")
+		self.m_buttons = registry.counter("encoder.buttons")
+		GPIO.add_event_detect(self.ENC_A, GPIO.BOTH, callback=self.pinChanged)
+		GPIO.add_event_detect(self.ENC_B, GPIO.BOTH, callback=self.pinChanged)
 		GPIO.add_event_detect(self.ENC_BUTTON, GPIO.BOTH, callback=self.pinChanged, bouncetime=200)
 
+	# The left and right events are called with the current velocity in detents per second
 	def registerLeftEvent(self, func):
-		EventManager.addEvent( onLeft = [func])
+		self.bus.register((self, "onLeft"), func)
 
 	def registerRightEvent(self, func):
-		EventManager.addEvent( onRight = [func])
+		self.bus.register((self, "onRight"), func)
 
 	def registerButtonPressedEvent(self, func):
-		EventManager.addEvent( onBtnPressed = [func])
+		self.bus.register((self, "onBtnPressed"), func)
 
 	def registerButtonReleasedEvent(self, func):
-		EventManager.addEvent( onBtnReleased = [func])
+		self.bus.register((self, "onBtnReleased"), func)
+
+	# feeds a new pin state into the quadrature decoder. Returns +1 for a completed right detent, -1 for a left detent
+	# and 0 otherwise
+	def decode(self, state, timestamp):
+		self.steps += self.TRANSITIONS[(self.state << 2) | state]
+		self.state = state
+		if self.steps >= self.steps_per_detent:
+			direction = 1
+		elif self.steps <= -self.steps_per_detent:
+			direction = -1
+		else:
+			return 0
+		self.steps = 0
+		# update the velocity from the time since the previous detent in the same direction
+		dt = timestamp - self.last_detent
+		if direction != self.last_direction or dt > self.VELOCITY_TIMEOUT or dt <= 0.0:
+			self.velocity = 0.0
+		elif self.velocity == 0.0:
+			self.velocity = 1.0 / dt
+		else:
+			self.velocity += self.VELOCITY_SMOOTHING * (1.0 / dt - self.velocity)
+		self.last_detent = timestamp
+		self.last_direction = direction
+		return direction
 
 	def pinChanged(self, channel):
-		Clk = GPIO.input(self.ENC_A)
-		Dir = GPIO.input(self.ENC_B)
-		Btn = GPIO.input(self.ENC_BUTTON)
-		if channel == self.ENC_A:
-			if (Clk == GPIO.LOW and Dir == GPIO.HIGH) or (Clk == GPIO.HIGH and Dir == GPIO.LOW):
+		timestamp = clock.monotonic()
+		if channel == self.ENC_A or channel == self.ENC_B:
+			state = (GPIO.input(self.ENC_A) << 1) | GPIO.input(self.ENC_B)
+			direction = self.decode(state, timestamp)
+			if direction != 0:
+				self.m_detents.add()
+			if direction > 0:
 				# Detected a right turn
-				EventManager.onRight()
-			else :
+				self.bus.post((self, "onRight"), self.velocity)
+			elif direction < 0:
 				# Detected a left turn
-				EventManager.onLeft()
-		elif channel == self.ENC_B:
-			if (Clk == GPIO.LOW and Dir == GPIO.HIGH) or (Clk == GPIO.HIGH and Dir == GPIO.LOW):
-				# Detected a left turn
-				EventManager.onLeft()
-			else:
-				# Detected a right turn
-				EventManager.onRight()
+				self.bus.post((self, "onLeft"), self.velocity)
 		elif channel == self.ENC_BUTTON:
+			self.m_buttons.add()
+			Btn = GPIO.input(self.ENC_BUTTON)
 			if Btn == GPIO.LOW:
 				# Detected a button press
-				if EventManager.onBtnPressed:
-					EventManager.onBtnPressed()
+				self.bus.post((self, "onBtnPressed"))
 			else:
 				# Detected a button release
-				if EventManager.onBtnReleased:
-					EventManager.onBtnReleased()
-
-
-
-
+				self.bus.post((self, "onBtnReleased"))
@@ -0,0 +1,70 @@
+import os
+import time
+
+
+# available hardware backends
+RPI = "rpi"		# RPi.GPIO and spidev on a Raspberry Pi
+SIM = "sim"		# simulated GPIO and SPI from panel.simhw, which run on any host
+BACKENDS = (RPI, SIM)
+
+# environment variable which selects the backend if <select> has not been called before the first hardware access
+ENVIRONMENT = "PANEL_HARDWARE"
+
+
+# Stand-in for a hardware module, which forwards to the selected backend. The attributes of the backend are copied into
+# the proxy when it is bound, so that a call like GPIO.input costs the same as with the module imported directly.
+class HardwareProxy:
+
+	def __init__(self, name):
+		self.__dict__["_name"] = name
+
+	def __getattr__(self, name):
+		# only called for attributes which have not been bound yet
+		if backend is None:
+			select(os.environ.get(ENVIRONMENT, RPI))
+			return getattr(self, name)
+		raise AttributeError("{} backend {} has no attribute {}".format(self._name, backend, name))
+
+	def __setattr__(self, name, value):
+		raise AttributeError("{} is a hardware proxy, select a backend instead".format(self._name))
+
+	def _bind(self, module):
+		name = self._name
+		self.__dict__.clear()
+		self.__dict__["_name"] = name
+		self.__dict__["_module"] = module
+		for attr in dir(module):
+			if not attr.startswith("__"):
+				self.__dict__[attr] = getattr(module, attr)
+
+
+# the hardware modules used by the panel classes: RPi.GPIO, spidev and a clock providing monotonic()
+GPIO = HardwareProxy("GPIO")
+spidev = HardwareProxy("spidev")
+clock = HardwareProxy("clock")
+
+# name of the selected backend
+backend = None
+
+
+# EXPORTED FUNCTION
+# Selects the hardware backend. Must be called before the panel devices are created. Returns the bound GPIO module, which
+# for the SIM backend is the SimGPIO instance used to script inputs
+def select(name):
+	global backend
+	if name == RPI:
+		import RPi.GPIO
+		import spidev as spi
+		GPIO._bind(RPi.GPIO)
+		spidev._bind(spi)
+		clock._bind(time)
+	elif name == SIM:
+		from panel.simhw import VirtualClock, SimGPIO, SimSpiModule
+		virtual = VirtualClock()
+		GPIO._bind(SimGPIO(virtual))
+		spidev._bind(SimSpiModule())
+		clock._bind(virtual)
+	else:
+		raise ValueError("Unknown hardware backend {}, use one of {}".format(name, ", ".join(BACKENDS)))
+	backend = name
+	return GPIO._module
@@ -1,6 +1,8 @@
-import RPi.GPIO as GPIO
+from panel.hardware import GPIO
+import math
 import time
 import threading
+from panel.metrics import registry
 
 
 class Keyboard(threading.Thread):
@@ -23,9 +25,35 @@ class Keyboard(threading.Thread):
 	BTN_ADF = 0x03
 	BTN_BFO = 0x13
 
-	def __init__(self, cols, rows):
+	# scanning modes
+	POLLING = 1		# scan all columns continuously
+	INTERRUPT = 2	# wait for a row interrupt while idle, then scan fast until all keys are released
+
+	# time in seconds each column is active before its rows are read
+	SCAN_INTERVAL = 0.040
+	# time in seconds each column is active in INTERRUPT mode while keys are being pressed
+	FAST_SCAN_INTERVAL = 0.0005
+	# time in seconds a key must keep its new level before it changes its state in INTERRUPT mode. Mechanical contacts
+	# bounce for 5 to 20 ms
+	DEBOUNCE_TIME = 0.020
+
+	# <debounce> overrides DEBOUNCE_TIME
+	def __init__(self, cols, rows, mode=POLLING, debounce=None):
 		threading.Thread.__init__(self)
-		self.keys = [[0 for x in range(len(cols))] for y in range(len(rows))]
+		self.mode = mode
+		# each key is sampled once per scan cycle of all columns, the debounce time is converted into a number of
+		# consecutive equal samples
+		debounce = debounce if debounce is not None else self.DEBOUNCE_TIME
+		self.debounceSamples = max(1, math.ceil(debounce / (self.FAST_SCAN_INTERVAL * len(cols))))
+		# debounced key states and the number of samples which differed from it, per column and row
+		self.keys = [[GPIO.HIGH for y in range(len(rows))] for x in range(len(cols))]
+		self.counts = [[0 for y in range(len(rows))] for x in range(len(cols))]
+		# True while any key is pressed or settling during the current scan cycle
+		self.busy = False
+		# set from the row interrupts to wake up the scanner
+		self.wake = threading.Event()
+		self.wakeHandler = self.wake.set
+		self.m_keys = registry.counter("keyboard.events")
 		# initialize the GPIO
 		GPIO.setmode(GPIO.BCM)
 		for c in cols:
@@ -34,6 +62,8 @@ class Keyboard(threading.Thread):
 
 		for r in rows:
 			GPIO.setup(r, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+			if mode == Keyboard.INTERRUPT:
+				GPIO.add_event_detect(r, GPIO.FALLING, callback=self.rowChanged)
 
 		self.cols = cols
 		self.rows = rows
@@ -48,42 +78,125 @@ class Keyboard(threading.Thread):
 		self.callbackPressed = cbkPressed
 		self.callbackReleased = cbkReleased
 
+	# replaces the function which is called from the row interrupts, e.g. to hand the wake up over to an event loop
+	def setWakeHandler(self, handler):
+		self.wakeHandler = handler
+
+	# GPIO callback for the row pins in INTERRUPT mode
+	def rowChanged(self, channel):
+		self.wakeHandler()
+
+	def report(self, col, idx, r):
+		kk = (col << 4) + idx
+		self.m_keys.add()
+		if r == GPIO.LOW:
+			if self.callbackPressed != 0:
+				self.callbackPressed(kk)
+			print ("Key %02x was pressed" % kk)
+		else:
+			if self.callbackReleased != 0:
+				self.callbackReleased(kk)
+			print ("Key %02x was released" % kk)
+
 	def updateStatus(self, col, rows):
 		for idx, r in enumerate(rows):
 			if self.keys[col][idx] != r:
 				self.keys[col][idx] = r
-				kk = (col << 4) + idx
-				if r == GPIO.LOW:
-					if self.callbackPressed != 0:
-						self.callbackPressed(kk)
-					print ("Key %02x was pressed" % kk)
-				else:
-					if self.callbackReleased != 0:
-						self.callbackReleased(kk)
-					print ("Key %02x was released" % kk)
-
+				self.report(col, idx, r)
 
+	# per key debounce state machine: a key changes its state after <debounceSamples> consecutive samples with the new level
+	def debounceStatus(self, col, rows):
+		keys = self.keys[col]
+		counts = self.counts[col]
+		for idx, r in enumerate(rows):
+			if keys[idx] != r:
+				self.busy = True
+				counts[idx] += 1
+				if counts[idx] >= self.debounceSamples:
+					keys[idx] = r
+					counts[idx] = 0
+					self.report(col, idx, r)
+			else:
+				counts[idx] = 0
+				if r == GPIO.LOW:
+					self.busy = True
+
+
+
+	# deactivates the previous column and activates the next one
+	def selectNextColumn(self):
+		GPIO.output(self.cols[self.col], GPIO.HIGH)
+		self.col = self.col + 1
+		if self.col > self.maxcol-1:
+			self.col = 0
+		GPIO.output(self.cols[self.col], GPIO.LOW)
+
+	# reads the rows of the active column and reports all changes
+	def readColumn(self):
+		rr = []
+		for r in self.rows:
+			rr.append( GPIO.input(r) )
+
+		self.updateStatus(self.col, rr)
+
+	# INTERRUPT mode: drives all columns low, so that any pressed key pulls its row low and raises an interrupt.
+	# Returns True if a row is already active
+	def enterIdle(self):
+		for c in self.cols:
+			GPIO.output(c, GPIO.LOW)
+		for r in self.rows:
+			if GPIO.input(r) == GPIO.LOW:
+				return True
+		return False
+
+	# INTERRUPT mode: deactivates all columns again, the next scan starts with the first column
+	def leaveIdle(self):
+		for c in self.cols:
+			GPIO.output(c, GPIO.HIGH)
+		self.col = self.maxcol-1
+		self.busy = False
+
+	# INTERRUPT mode: reads the rows of the active column through the debounce state machine. Returns True at the end of
+	# a scan cycle in which all keys were released and settled
+	def readColumnDebounced(self):
+		rr = []
+		for r in self.rows:
+			rr.append( GPIO.input(r) )
+		self.debounceStatus(self.col, rr)
+		if self.col == self.maxcol-1:
+			settled = not self.busy
+			self.busy = False
+			return settled
+		return False
 
 	def run(self):
+		if self.mode == Keyboard.INTERRUPT:
+			self.runInterrupt()
+			return
 		while self.active == True:
-			# deactivate prev column
-			GPIO.output(self.cols[self.col], GPIO.HIGH)
-			self.col = self.col + 1
-			if self.col > self.maxcol-1:
-				self.col = 0
-			GPIO.output(self.cols[self.col], GPIO.LOW)
+			self.selectNextColumn()
 			# wait shortly
-			time.sleep(0.040)
+			time.sleep(self.SCAN_INTERVAL)
 			# read status
-			rr = []
-			for r in self.rows:
-				rr.append( GPIO.input(r) )
+			self.readColumn()
 
-			self.updateStatus(self.col, rr)
+	# INTERRUPT mode: sleeps until a row interrupt arrives, then scans fast until all keys have been released
+	def runInterrupt(self):
+		while self.active == True:
+			self.wake.clear()
+			if not self.enterIdle():
+				self.wake.wait()
+			self.leaveIdle()
+			while self.active == True:
+				self.selectNextColumn()
+				time.sleep(self.FAST_SCAN_INTERVAL)
+				if self.readColumnDebounced():
+					break
 
 	def stop(self):
 		print ("*** Keyboard terminating")
 		self.active = False
+		self.wake.set()
 
 
 
@@ -1,7 +1,43 @@
-import spidev
+from panel.hardware import spidev
+from panel.metrics import registry
 import time
 
 
+# segment values of the characters which can be shown on the 7 segment digits
+CHAR_LOOKUP = {
+	'0':	0b01111110,
+	'1': 	0b00110000,
+	'2':	0b01101101,
+	'3':	0b01111001,
+	'4':	0b00110011,
+	'5':	0b01011011,
+	'6':	0b01011111,
+	'7':	0b01110000,
+	'8':	0b01111111,
+	'9':	0b01111011,
+	'-':	0b00000001,
+	'H':	0b00110111,
+	'A':	0b01110111,
+	'a':	0b01110111,
+	'B':	0b01111111,
+	'C':	0b01001110,
+	'E':	0b01001111,
+	'F':	0b01000111,
+	'f':	0b01000111,
+	'J':	0b00111000,
+	'j':	0b00111000,
+	'L':	0b00001110,
+	'O':	0b01111110,
+	'o':	0b00011101,
+	'P':	0b01100111,
+	'p':	0b01100111,
+	'R':	0b01100110,
+	'r':	0b00000101,
+	'S':	0b01011011,
+	' ':	0b00000000
+}
+
+
 def get_digit(number, digit):
 	return int(number // 10**digit %10)
 
@@ -12,7 +48,8 @@ class Lcd:
 	NORMAL = 2
 	SHUTDOWN = 4
 
-	def __init__(self, max_speed_hz, max_displays):
+	# If <autoflush> is False, digit changes are only collected in the framebuffer and written by <flush>
+	def __init__(self, max_speed_hz, max_displays, autoflush=True):
 		self.spi = spidev.SpiDev()
 		self.spi.open(0,0)
 		self.spi.max_speed_hz	= max_speed_hz
@@ -23,41 +60,22 @@ class Lcd:
 		self.max_displays	= max_displays
 		self.max_digits = [1 for x in range(max_displays)]
 		self.values		= [[ 0 for x in range(8)] for y in range(max_displays)]
-		self.char_lookup = {
-			'0':	0b01111110,
-			'1': 	0b00110000,
-			'2':	0b01101101,
-			'3':	0b01111001,
-			'4':	0b00110011,
-			'5':	0b01011011,
-			'6':	0b01011111,
-			'7':	0b01110000,
-			'8':	0b01111111,
-			'9':	0b01111011,
-			'-':	0b00000001,
-			'H':	0b00110111,
-			'A':	0b01110111,
-			'a':	0b01110111,
-			'B':	0b01111111,
-			'C':	0b01001110,
-			'E':	0b01001111,
-			'F':	0b01000111,
-			'f':	0b01000111,
-			'J':	0b00111000,
-			'j':	0b00111000,
-			'L':	0b00001110,
-			'O':	0b01111110,
-			'o':	0b00011101,
-			'P':	0b01100111,
-			'p':	0b01100111,
-			'R':	0b01100110,
-			'r':	0b00000101,
-			'S':	0b01011011,
-			' ':	0b00000000
-		}
+		# framebuffer state: per device a bit mask of digit registers which differ from what has been written to the chip
+		self.dirty		= [0 for y in range(max_displays)]
+		self.autoflush	= autoflush
+		self.m_transactions = registry.counter("spi.transactions")
+		self.m_bytes = registry.counter("spi.bytes")
+		self.invalidate()
+		self.char_lookup = CHAR_LOOKUP
 		print (self.char_lookup)
 		self.sendToAll([0x09, 0x00])
 
+	# Writes a single SPI transaction
+	def write(self, arr):
+		self.spi.writebytes(arr)
+		self.m_transactions.add()
+		self.m_bytes.add(len(arr))
+
 	# This function sends a tuple (16-bit) value to the display with number <devno>
 	def send(self, devno, b):
 		arr = []
@@ -67,7 +85,7 @@ class Lcd:
 			else:
 				arr = arr + [0x00, 0x00]
 #		print ("***Lcd.send(devno={}, b={}, arr={}".format(devno, b, arr))
-		self.spi.writebytes(arr)
+		self.write(arr)
 
 	# This function send a tuple (16-bit) value to all displays at once
 	def sendToAll(self, b):
@@ -75,7 +93,7 @@ class Lcd:
 		for i in range(self.max_displays):
 			arr = arr + b
 #		print ("***Lcd.sendAll(b={}, arr={}".format(b, arr))
-		self.spi.writebytes(arr)
+		self.write(arr)
 
 	# This function sets the given mode to all displays. Can be either NORMAL, TEST or SHUTDOWN
 	def setModeAll(self, mode):
@@ -126,33 +144,62 @@ class Lcd:
 	# Sets the a single digit of display <devno> to the given raw value. The function will not actually flush the values
 	# if the parameter <flush> is false.
 	def setDigitValue(self, devno, d, v, flush=False):
-		self.values[devno][d] = v
+		if self.values[devno][d] != v:
+			self.values[devno][d] = v
+			self.dirty[devno] |= 1 << d
 		if flush== True:
 			self.sendAll(devno)
 
-	# Flushes the current buffers to the given display
+	# Marks all digit registers of all displays as dirty, so that the next flush rewrites them
+	def invalidate(self):
+		for devno in range(self.max_displays):
+			self.dirty[devno] = 0xff
+
+	# Writes all dirty digit registers. Each register row is written in a single transaction, which carries the data for
+	# every device in the chain, rows which did not change on any device are skipped. A row stays dirty until its write
+	# has succeeded, so after a failed write the next flush sends the rows which have not reached the chips.
+	def flush(self):
+		rows = 0
+		for devno in range(self.max_displays):
+			rows |= self.dirty[devno]
+		if rows == 0:
+			return
+		for i in range(8):
+			if rows & (1 << i):
+				arr = []
+				for devno in range(self.max_displays):
+					arr += [i+1, self.values[devno][i]]
+				self.write(arr)
+				for devno in range(self.max_displays):
+					self.dirty[devno] &= ~(1 << i)
+
+	# Flushes the current buffers to the given display. Only changed registers are written
 	def sendAll(self, devno):
 #		print ("***Lcd.sendAll(devno={})".format(devno))
-		for i in range(8):
-			self.send(devno, [i+1, self.values[devno][i]])
+		if self.autoflush:
+			self.flush()
 
 	# Sets a specific digits to given values. This is given as an array of <index, value> pairs
 	def setDigitValues(self, devno, vals):
 		for i,d in enumerate(vals):
-			self.values[devno][i] = d
+			self.setDigitValue(devno, i, d)
 		self.sendAll(devno)
 
+	# Renders a string into the raw segment values of the digits it covers, using the internal lookup table. A '.' sets
+	# the decimal point of the previous digit, characters without a glyph are skipped.
+	def renderString(self, dv):
+		vals = []
+		for v in dv:
+			if v in self.char_lookup:
+				vals.append(self.char_lookup[v])
+			elif v == '.' and vals:
+				vals[-1] = vals[-1] | 128
+		return vals
+
 	# Sets a string to device <devno>, using the internal lookup table
 	def setDigitString(self, devno, dv):
-		i = 0
-		for v in dv:
-			if v in self.char_lookup.keys():
-				self.values[devno][i] = self.char_lookup[v]
-				i = i + 1
-			elif v == '.':
-				self.values[devno][i-1] = self.values[devno][i-1]+128
-			else:
-				self.values[devno][i] = v
+		for i, d in enumerate(self.renderString(dv)[:8]):
+			self.setDigitValue(devno, i, d)
 #		print ("*****", self.values[devno])
 		self.sendAll(devno)
 
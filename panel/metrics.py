@@ -0,0 +1,200 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+
+# Monotonically increasing event counter. Increments are not locked, they are cheap enough for the receive path and
+# a lost increment under contention does not matter for statistics
+class Counter:
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0
+
+	def add(self, n=1):
+		self.value += n
+
+
+# Latency histogram with power of two buckets in microseconds: bucket i counts the samples below 2**i us
+class Histogram:
+	BUCKETS = 32
+	__slots__ = ("count", "total", "max", "buckets")
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.buckets = [0] * self.BUCKETS
+
+	# adds a sample given in seconds
+	def observe(self, seconds):
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+		us = int(seconds * 1e6) if seconds > 0.0 else 0
+		self.buckets[min(us.bit_length(), self.BUCKETS - 1)] += 1
+
+	# returns the upper bound in seconds of the bucket which contains the given fraction of the samples
+	def percentile(self, fraction):
+		if self.count == 0:
+			return None
+		rank = fraction * self.count
+		seen = 0
+		for i, n in enumerate(self.buckets):
+			seen += n
+			if seen >= rank:
+				return min((1 << i) * 1e-6, self.max)
+		return self.max
+
+	def snapshot(self):
+		if self.count == 0:
+			return {"count": 0}
+		return {
+			"count": self.count,
+			"mean_ms": round(self.total / self.count * 1e3, 3),
+			"p50_ms": round(self.percentile(0.5) * 1e3, 3),
+			"p90_ms": round(self.percentile(0.9) * 1e3, 3),
+			"p99_ms": round(self.percentile(0.99) * 1e3, 3),
+			"max_ms": round(self.max * 1e3, 3),
+		}
+
+
+# Registry of all counters and histograms of the process. Components look their metrics up once when they are created
+# and update them directly, readers take snapshots.
+class Metrics:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+		self.started = time.monotonic()
+
+	# returns the counter with the given name, it is created on first use
+	def counter(self, name):
+		with self.lock:
+			if name not in self.counters:
+				self.counters[name] = Counter()
+			return self.counters[name]
+
+	# returns the histogram with the given name, it is created on first use
+	def histogram(self, name):
+		with self.lock:
+			if name not in self.histograms:
+				self.histograms[name] = Histogram()
+			return self.histograms[name]
+
+	# returns the current values of all metrics as plain data
+	def snapshot(self):
+		with self.lock:
+			counters = {name: c.value for name, c in sorted(self.counters.items())}
+			histograms = {name: h.snapshot() for name, h in sorted(self.histograms.items())}
+		now = time.monotonic()
+		return {"time": now, "uptime": round(now - self.started, 3), "counters": counters, "histograms": histograms}
+
+	# returns a snapshot with the per second rates of all counters since the <previous> snapshot added
+	def report(self, previous=None):
+		current = self.snapshot()
+		if previous is None:
+			elapsed = current["uptime"]
+			before = {}
+		else:
+			elapsed = current["time"] - previous["time"]
+			before = previous["counters"]
+		if elapsed > 0.0:
+			current["rates"] = {name: round((value - before.get(name, 0)) / elapsed, 3) for name, value in current["counters"].items()}
+		return current
+
+	def reset(self):
+		with self.lock:
+			for c in self.counters.values():
+				c.value = 0
+			for h in self.histograms.values():
+				h.reset()
+			self.started = time.monotonic()
+
+
+# the metrics of this process
+registry = Metrics()
+
+
+# Serves the metrics as JSON on a loopback HTTP port:  curl http://127.0.0.1:9107/metrics
+# The rates are calculated since the previous request.
+class MetricsServer(threading.Thread):
+	DEFAULT_PORT = 9107
+
+	def __init__(self, port=None, host="127.0.0.1", metrics=None):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.metrics = metrics if metrics is not None else registry
+		self.previous = None
+		server = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] not in ("/", "/metrics"):
+					self.send_error(404)
+					return
+				body = json.dumps(server.report(), indent=2).encode("utf-8")
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		self.httpd = http.server.HTTPServer((host, port if port is not None else self.DEFAULT_PORT), Handler)
+		self.port = self.httpd.server_address[1]
+
+	def report(self):
+		report = self.metrics.report(self.previous)
+		self.previous = report
+		return report
+
+	def run(self):
+		self.httpd.serve_forever()
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+# Writes the metrics as JSON to <path> every <interval> seconds. The file is replaced atomically, so readers never see a
+# partial report. The last report is written when the writer is stopped.
+class StatsWriter(threading.Thread):
+	DEFAULT_INTERVAL = 10.0
+
+	def __init__(self, path, interval=None, metrics=None):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.path = path
+		self.interval = interval if interval else self.DEFAULT_INTERVAL
+		self.metrics = metrics if metrics is not None else registry
+		self.previous = None
+		self.stopped = threading.Event()
+
+	def write(self):
+		report = self.metrics.report(self.previous)
+		self.previous = report
+		tmpfile = self.path + ".tmp"
+		try:
+			with open(tmpfile, "w") as f:
+				json.dump(report, f, indent=2)
+			os.replace(tmpfile, self.path)
+		except OSError as e:
+			print ("Stats file {} cannot be written: {}".format(self.path, e))
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.write()
+		self.write()
+
+	def stop(self):
+		self.stopped.set()
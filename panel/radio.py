@@ -1,10 +1,13 @@
+import time
 from panel.config import config
 from panel.display import Display
 from panel.max7219 import Lcd
-from panel.encoder import Encoder
+from panel.encoder import Encoder, EventBus
 from panel.xplane import xplane
 from panel.keymatrix import Keyboard
 from panel.onoffswitch import OnOffSwitch
+from panel.scheduler import RenderScheduler
+from panel.metrics import registry
 
 class Radio:
 
@@ -20,9 +23,20 @@ class Radio:
 	MODE_HF1  = 17
 	MODE_HF2  = 18
 
-	def __init__(self, dbg=0):
+	# If a <runtime> is given, the radio is served by its event loop instead of running its own threads. <fps> caps the
+	# number of redraws per second. Panels which shall share one x-plane connection are given the same <connection>,
+	# which is then started and stopped by its creator
+	def __init__(self, dbg=0, runtime=None, fps=None, connection=None):
 		self.active = True
 		self.dbg = dbg
+		# GPIO, keyboard and x-plane callbacks arrive on different threads. They are all posted to one event bus, whose
+		# dispatcher is the only thread changing the radio state. With a runtime the bus dispatches on the event loop
+		if runtime is not None:
+			self.bus = runtime.bus()
+		else:
+			self.bus = EventBus()
+			self.bus.start()
+		post = self.bus.wrap
 		# when user presses the xchange button, while the radio is OFF, the profile_selection_active mode will be entered. during this mode
 		# the user can select which configuration profile is being used
 		self.profile_selection_active = False
@@ -40,10 +54,22 @@ class Radio:
 		self.Mode = Radio.MODE_NAV1
 		# set the increment mode : a value of zero means a small increment on rotary encoder changes, a value of 1 means large increments
 		self.incMode = 0
-		# create the display (LCD + LEDs) device
+		# create the display (LCD + LEDs) device. Redraws are requested by update and performed by the render scheduler
 		self.display = Display()
+		# the displays are only written by the render function. Shutdown mode and brightness are kept here and written
+		# by the next frame when they differ from what the displays show
+		self.enabled = True
+		self.brightness = self.display.brightness
+		# histogram name -> post time of the oldest event which requested the next redraw, observed when it is flushed
+		self.pending = {}
+		self.m_frames = registry.counter("render.frames")
+		if runtime is not None:
+			self.renderer = runtime.scheduler(self.render, fps)
+		else:
+			self.renderer = RenderScheduler(self.render, fps)
+			self.renderer.start()
 		# create the rotary encoder device and register the callbacks
-		self.encoder = Encoder(17, 27, 22)
+		self.encoder = Encoder(17, 27, 22, bus=self.bus)
 		self.encoder.registerLeftEvent(self.onEncoderLeft)
 		self.encoder.registerRightEvent(self.onEncoderRight)
 		self.encoder.registerButtonPressedEvent(self.onEncoderButtonPressed)
@@ -113,43 +139,55 @@ class Radio:
 			"ils_course":		self.cbkFrequencyValueChanged,
 			"integ_light":		self.cbkBacklightValueChanged
 		}
+		# the x-plane receiver thread posts the value changes to the event bus
+		self.callbacks = {var: post(cbk) for var, cbk in self.callbacks.items()}
 
-		# Initialize the xplane receiver
-		self.xplane = xplane(self.cfg, dbg)
-		self.xplane.start()
+		# Initialize the xplane connection and the client of this panel
+		self.ownConnection = connection is None
+		if connection is None:
+			connection = xplane(dbg)
+		self.connection = connection
+		self.xplane = connection.connect(self.cfg)
+		# setup the keyboard and register the callback
+		self.keyboard = Keyboard( [0,5,6,13], [4,3,2,19], Keyboard.INTERRUPT)
+		self.keyboard.registerCallbacks(post(self.onKeyPressed), 0)
+		if runtime is not None:
+			runtime.attach(self.connection, self.keyboard)
+		else:
+			if self.ownConnection:
+				self.connection.start()
+			self.keyboard.start()
 		# Setup callbacks for server variable changes as needed
 		self.xplane.startReceiver(self.callbacks)
-		# setup the keyboard and register the callback
-		self.keyboard = Keyboard( [0,5,6,13], [4,3,2,19])
-		self.keyboard.registerCallbacks(self.onKeyPressed, 0)
-		self.keyboard.start()
 		# setup the OnOffSwitch
-		self.OnOff = OnOffSwitch(26, self.OnOffChanged)
-		self.OnOffChanged(self.OnOff.getState())
+		self.OnOff = OnOffSwitch(26, post(self.OnOffChanged))
+		# the initial state is handled on the dispatcher like every change, the bus and the receiver are already running
+		post(self.OnOffChanged)(self.OnOff.getState())
 
 	def OnOffChanged(self, newval):
 		print ("OnOff Switch")
 		if newval == 0:
-			# switch the panel off
+			# switch the panel off, the render thread shuts the displays down
 			self.panel_off = True
-			self.display.enable(False)
+			self.xplane.setFocus(())
+			self.renderer.request()
 		else:
 			# switch the panel on
 			self.panel_off = False
 			self.profile_selection_active = False
-			self.display.enable(True)
 			self.update()
 
 	# This callback will be called whenever a new value from XPLANE is received
 	def cbkFrequencyValueChanged(self, idx, newval):
 		self.frequencies[idx] = newval
-		self.update()
+		self.update("latency.rref_to_spi")
 
 	# This callback will be called whenever the backlight value in XPLANE is changed
 	def cbkBacklightValueChanged(self, idx, newval):
 		if self.dbg >=2:
 			print ('Backlight Pedestal changed to {}'.format(newval))
-		self.display.setBrightness(newval)
+		self.brightness = newval
+		self.renderer.request()
 
 	# This callback is called when the user presses a key
 	def onKeyPressed(self, key):
@@ -196,10 +234,7 @@ class Radio:
 					self.AMselected = not self.AMselected
 			elif key == Keyboard.BTN_XCHG:
 				# exchange standby frequency with active frequency
-				freq = self.getActiveFrequency()
-				freq_2 = self.getStandbyFrequency(True)
-				self.setActiveFrequency(freq_2)
-				self.setStandbyFrequency(freq, True)
+				self.swapFrequencies()
 				if self.Mode == self.MODE_NAV1:
 					self.IlsCourseEditingActive = not self.IlsCourseEditingActive
 				elif self.Mode == self.MODE_NAV2:
@@ -257,7 +292,7 @@ class Radio:
 	def setStandbyFrequency(self, freq, IgnoreOverrides=False):
 		key = self.getStandbyFrequencyKey(IgnoreOverrides)
 		self.frequencies[key] = freq
-		self.xplane.setValue(key, freq)
+		self.xplane.setValue(key, freq, self.bus.timestamp)
 
 	def getActiveFrequency(self):
 		return self.frequencies[self.getActiveFrequencyKey()]
@@ -265,65 +300,67 @@ class Radio:
 	def setActiveFrequency(self, freq):
 		key = self.getActiveFrequencyKey()
 		self.frequencies[key] = freq
-		self.xplane.setValue(key, freq)
+		self.xplane.setValue(key, freq, self.bus.timestamp)
 
-	def onEncoderLeft(self):
+	# exchanges the active and the standby frequency of the current mode. If the profile maps the <mode>_swap action to
+	# an x-plane command, e.g. sim/radios/com1_standy_flip, both are swapped by x-plane with a single packet, otherwise
+	# both frequencies are written
+	def swapFrequencies(self):
+		active = self.getActiveFrequencyKey()
+		standby = self.getStandbyFrequencyKey(True)
+		freq = self.frequencies[active]
+		freq_2 = self.frequencies[standby]
+		self.frequencies[active] = freq_2
+		self.frequencies[standby] = freq
+		if not self.xplane.command(active.replace("_freq", "_swap"), {active: freq_2, standby: freq}):
+			self.xplane.setValue(active, freq_2, self.bus.timestamp)
+			self.xplane.setValue(standby, freq, self.bus.timestamp)
+
+	def onEncoderLeft(self, velocity=0.0):
 		if self.profile_selection_active:
-			self.xplane.stopReceiver()
 			self.cfg.prevProfile()
-			self.xplane.startReceiver(self.callbacks)
+			self.xplane.switchProfile(self.callbacks)
 		elif self.OnOff.getState() == False:
 				return
 		else:
 			# Decrement the frequency
-			key = self.getStandbyFrequencyKey()
-			if self.incMode == 0:
-				incr = -float(self.cfg.getVariableItem(key, "increment_lo"))
-			else:
-				incr = -float(self.cfg.getVariableItem(key,"increment_hi"))
-			maxfreq = float(self.cfg.getVariableItem(key, "range_in_max"))
-			minfreq = float(self.cfg.getVariableItem(key, "range_in_min"))
-			freq = self.frequencies[key] + incr
-			if freq < minfreq:
-				freq = maxfreq
-			elif freq > maxfreq:
-				freq = minfreq
-			if self.dbg >=1:
-				print ("*** New value {} is {}".format(key, freq))
-			self.frequencies[key] = freq
-			# Send frequency
-			self.xplane.setValue(key, freq)
+			self.turnStandbyFrequency(-1, velocity)
 		self.update()
 
-	def onEncoderRight(self):
+	def onEncoderRight(self, velocity=0.0):
 		if self.profile_selection_active:
-			self.xplane.stopReceiver()
 			self.cfg.nextProfile()
-			self.xplane.startReceiver(self.callbacks)
+			self.xplane.switchProfile(self.callbacks)
 		elif self.OnOff.getState() == False:
 			return
 		else:
 			# Increment the frequency
-			key = self.getStandbyFrequencyKey()
-			if self.incMode == 0:
-				incr = float(self.cfg.getVariableItem(key, "increment_lo"))
-			else:
-				incr = float(self.cfg.getVariableItem(key, "increment_hi"))
-			maxfreq = float(self.cfg.getVariableItem(key, "range_in_max"))
-			minfreq = float(self.cfg.getVariableItem(key, "range_in_min"))
-			freq = self.frequencies[key] + incr
-			if freq < minfreq:
-				freq = maxfreq
-			elif freq > maxfreq:
-				freq = minfreq
-			if self.dbg >=1:
-				print ("*** New value {} is {}".format(key, freq))
-			self.frequencies[key] = freq
-			# Send frequency
-			self.xplane.setValue(key, freq)
-			# Call setMode in order to display the new values
+			self.turnStandbyFrequency(1, velocity)
 		self.update()
 
+	# changes the standby frequency by one detent in the given direction. The step is scaled by the acceleration curve of
+	# the variable, so that turning the encoder fast moves the frequency in bigger steps
+	def turnStandbyFrequency(self, direction, velocity):
+		key = self.getStandbyFrequencyKey()
+		codec = self.cfg.getCodec(key)
+		if self.incMode == 0:
+			incr = codec.increment_lo
+		else:
+			incr = codec.increment_hi
+		incr = direction * incr * codec.stepMultiplier(velocity)
+		maxfreq = codec.range_max
+		minfreq = codec.range_min
+		freq = self.frequencies[key] + incr
+		if freq < minfreq:
+			freq = maxfreq
+		elif freq > maxfreq:
+			freq = minfreq
+		if self.dbg >=1:
+			print ("*** New value {} is {}".format(key, freq))
+		self.frequencies[key] = freq
+		# Send frequency
+		self.xplane.setValue(key, freq, self.bus.timestamp)
+
 	def onEncoderButtonPressed(self):
 		if self.profile_selection_active:
 			self.profile_selection_active = False
@@ -380,20 +417,45 @@ class Radio:
 			self.display.clearStbyFrequency()
 			self.display.selectActiveMode(Display.NONE)
 			self.display.selectStbyNavMode(Display.NONE)
+		self.display.flush()
+
+	# Requests an update of the displays and the LEDs. The redraw happens asynchronously with the next frame, so callers
+	# never block on the SPI bus and a burst of changes results in a single redraw
+	# <latency> names the histogram which gets the time from the event being dispatched to the SPI write of the redraw
+	def update(self, latency="latency.input_to_spi"):
+		if self.bus.timestamp is not None:
+			self.pending.setdefault(latency, self.bus.timestamp)
+		self.xplane.setFocus(self.getDisplayedVariables())
+		self.renderer.request()
+
+	# returns the variables shown on the displays in the current mode. In the NAV modes the course is included, so
+	# that it is up to date when the course editing is toggled
+	def getDisplayedVariables(self):
+		if self.panel_off or self.profile_selection_active or self.Mode == self.MODE_COM3:
+			return ()
+		shown = [self.getActiveFrequencyKey(), self.getStandbyFrequencyKey(True)]
+		if self.Mode == self.MODE_NAV1:
+			shown.append("ils_course")
+		elif self.Mode == self.MODE_NAV2:
+			shown.append("vor_course")
+		return shown
 
 	# Update the displays and the LEDs
-	def update(self):
+	def render(self):
+		enabled = self.profile_selection_active or not self.panel_off
+		if enabled != self.enabled:
+			self.display.enable(enabled)
+			self.enabled = enabled
+		if self.brightness != self.display.brightness:
+			self.display.setBrightness(self.brightness)
 		if self.profile_selection_active:
-			self.display.enable(True)
 			act_profile_num = self.cfg.getActiveProfileNum()
 			act_profile_name= self.cfg.getActiveProfileName()
 			print ('Pro {:1d}'.format(act_profile_num))
 			print ('{:>6s}'.format(act_profile_name))
 			self.display.setActiveText('Pro {:1d}', act_profile_num)
 			self.display.setStandbyText('{:>6s}', act_profile_name)
-		elif self.panel_off:
-			self.display.enable(False)
-		else:
+		elif not self.panel_off:
 			if self.NavOverride == True:
 				self.display.selectActiveMode(Display.NAV)
 			if self.Mode == self.MODE_NAV1:
@@ -486,10 +548,21 @@ class Radio:
 				self.display.selectStbyNavMode(Display.NONE)
 			if self.dbg >=1:
 				print ('Mode is {}'.format(_mode))
+		# write all changed digits and LEDs at once
+		self.display.flush()
+		self.m_frames.add()
+		if self.pending:
+			now = time.monotonic()
+			for latency in list(self.pending):
+				registry.histogram(latency).observe(now - self.pending.pop(latency))
 
 	def stop(self):
+		self.renderer.stop()
 		self.xplane.stop()
+		if self.ownConnection:
+			self.connection.stop()
 		self.display.enable(False)
 		self.keyboard.stop()
+		self.bus.stop()
 		print ("...Radio terminated...")
 
@@ -0,0 +1,297 @@
+import asyncio
+
+import time
+
+from panel.beacon import XPlaneBeaconListener
+from panel.encoder import Event
+from panel.metrics import registry
+from panel.scheduler import RenderScheduler
+from panel.xplane import DrefWriter
+
+
+# Protocol for the x-plane data socket. After a datagram has been received, all datagrams which are already queued on
+# the socket are drained as well and parsed at once, so every changed value is dispatched a single time.
+class XPlaneProtocol(asyncio.DatagramProtocol):
+
+	def __init__(self, xp):
+		self.xp = xp
+		self.buf = bytearray(xp.RECV_BUFSIZE)
+		self.view = memoryview(self.buf)
+
+	def datagram_received(self, data, addr):
+		xp = self.xp
+		retvalues = {}
+		xp._decode(data, memoryview(data), len(data), retvalues)
+		# the transport has switched the socket to non-blocking mode, so this returns as soon as the queue is empty
+		try:
+			while True:
+				nbytes = xp.sock.recv_into(self.buf)
+				xp._decode(self.buf, self.view, nbytes, retvalues)
+		except (BlockingIOError, InterruptedError):
+			pass
+		xp._complete(retvalues)
+
+	def error_received(self, exc):
+		print ("Socket error !")
+
+
+# Protocol for the beacon socket. Instead of polling with a socket timeout, a timer is rearmed with each beacon and
+# switches the listener back to SEARCHING when no beacon has been seen for <timeout> seconds.
+class BeaconProtocol(asyncio.DatagramProtocol):
+
+	def __init__(self, beacon, loop, timeout=3.0):
+		self.beacon = beacon
+		self.loop = loop
+		self.timeout = timeout
+		self.timer = None
+
+	def datagram_received(self, data, addr):
+		self.beacon.handleMessage(data)
+		if self.timer is not None:
+			self.timer.cancel()
+		self.timer = self.loop.call_later(self.timeout, self.beacon.changeState, XPlaneBeaconListener.SEARCHING)
+
+	def connection_lost(self, exc):
+		if self.timer is not None:
+			self.timer.cancel()
+
+
+# Writer for dataref values which runs on the event loop instead of its own thread. Coalescing and rate limiting
+# behave exactly like in DrefWriter, the next due value is sent from a loop timer.
+class LoopDrefWriter(DrefWriter):
+
+	def __init__(self, loop, send, rate=None):
+		DrefWriter.__init__(self, send, rate)
+		self.loop = loop
+		self.timer = None
+
+	def write(self, dataref, value, rate=None, origin=None):
+		DrefWriter.write(self, dataref, value, rate, origin)
+		self._service()
+
+	# INTERNAL FUNCTION
+	# Sends all due values and arms the timer for the next pending one
+	def _service(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		with self.cond:
+			due, timeout = self._collect()
+		for dataref, value, origin in due:
+			self._send(dataref, value, origin)
+		if timeout is not None and self.active:
+			self.timer = self.loop.call_later(timeout, self._service)
+
+	def stop(self):
+		DrefWriter.stop(self)
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+
+# Render scheduler which runs on the event loop. Requests are collected and the render function is called from a
+# loop callback at most <rate> times per second
+class LoopRenderScheduler:
+
+	def __init__(self, loop, render, rate=None):
+		self.loop = loop
+		self.render = render
+		self.interval = 1.0 / (rate if rate else RenderScheduler.DEFAULT_RATE)
+		self.active = True
+		self.handle = None
+		self.last_frame = 0.0
+		self.frames = 0
+		self.requests = 0
+
+	# EXPORTED FUNCTION
+	# Marks the state as dirty. Must be called on the loop thread
+	def request(self):
+		self.requests += 1
+		if self.handle is None and self.active:
+			wait = self.last_frame + self.interval - time.monotonic()
+			if wait > 0.0:
+				self.handle = self.loop.call_later(wait, self._frame)
+			else:
+				self.handle = self.loop.call_soon(self._frame)
+
+	def _frame(self):
+		self.handle = None
+		self.last_frame = time.monotonic()
+		self.frames += 1
+		self.render()
+
+	def stop(self):
+		self.active = False
+		if self.handle is not None:
+			self.handle.cancel()
+			self.handle = None
+
+
+# Event bus with the interface of EventBus, which dispatches on the event loop instead of its own thread. Events may
+# be posted from any thread
+class LoopEventBus:
+
+	def __init__(self, loop):
+		self.loop = loop
+		self.active = True
+		self.events = {}
+		self.dropped = 0
+		self.latency = 0.0
+		self.timestamp = None
+		self.m_events = registry.counter("bus.events")
+		self.m_dropped = registry.counter("bus.dropped")
+		self.m_latency = registry.histogram("latency.bus")
+		self.m_errors = registry.counter("bus.errors")
+
+	def register(self, name, func):
+		if name not in self.events:
+			self.events[name] = Event([])
+		self.events[name] += func
+
+	def post(self, name, *args):
+		self._put(time.monotonic(), name, args)
+
+	def wrap(self, func):
+		def wrapper(*args):
+			self._put(time.monotonic(), func, args)
+		return wrapper
+
+	def _put(self, timestamp, event, args):
+		try:
+			self.loop.call_soon_threadsafe(self._dispatch, timestamp, event, args)
+		except RuntimeError:
+			# the loop has already been closed
+			self.dropped += 1
+			self.m_dropped.add()
+
+	def _dispatch(self, timestamp, event, args):
+		if not self.active:
+			return
+		self.latency = time.monotonic() - timestamp
+		self.timestamp = timestamp
+		self.m_events.add()
+		self.m_latency.observe(self.latency)
+		try:
+			if callable(event):
+				event(*args)
+			elif event in self.events:
+				self.events[event](*args)
+		except Exception as e:
+			self.m_errors.add()
+			print ("Event handler {} failed: {!r}".format(getattr(event, "__name__", event), e))
+
+	def start(self):
+		pass
+
+	def stop(self):
+		self.active = False
+
+
+# This class runs one or more panels on a single asyncio event loop. The x-plane and beacon sockets are served by
+# datagram protocols, the keyboard is scanned by a coroutine and GPIO callbacks, which RPi.GPIO delivers on its own
+# thread, are handed over to the loop. All panel state is therefore changed from the loop thread only.
+class Runtime:
+
+	def __init__(self, dbg=0):
+		self.dbg = dbg
+		self.loop = asyncio.new_event_loop()
+		self.connections = []
+		self.keyboards = []
+		self.transports = []
+		self.tasks = []
+
+	# EXPORTED FUNCTION
+	# Returns a wrapper for <func>, which can be called from any thread and executes <func> on the event loop
+	def threadsafe(self, func):
+		loop = self.loop
+		def wrapper(*args):
+			loop.call_soon_threadsafe(func, *args)
+		return wrapper
+
+	# EXPORTED FUNCTION
+	# Returns a render scheduler for <render> which runs on the event loop
+	def scheduler(self, render, rate=None):
+		return LoopRenderScheduler(self.loop, render, rate)
+
+	# EXPORTED FUNCTION
+	# Returns an event bus which dispatches on the event loop
+	def bus(self):
+		return LoopEventBus(self.loop)
+
+	# EXPORTED FUNCTION
+	# Registers a panel with its xplane connection and keyboard to be served by this runtime. Panels may share a
+	# connection, it is only served once
+	def attach(self, xp, keyboard=None):
+		if xp not in self.connections:
+			xp.writer = LoopDrefWriter(self.loop, xp._sendValue)
+			self.connections.append(xp)
+		if keyboard is not None:
+			self.keyboards.append(keyboard)
+
+	# INTERNAL FUNCTION
+	# Scans the keyboard matrix one column at a time. In INTERRUPT mode the coroutine sleeps until a row interrupt
+	# arrives and scans fast until all keys are released
+	async def _scanKeyboard(self, keyboard):
+		if keyboard.mode == keyboard.INTERRUPT:
+			wake = asyncio.Event()
+			keyboard.setWakeHandler(self.threadsafe(wake.set))
+			while keyboard.active == True:
+				wake.clear()
+				if not keyboard.enterIdle():
+					await wake.wait()
+				keyboard.leaveIdle()
+				while keyboard.active == True:
+					keyboard.selectNextColumn()
+					await asyncio.sleep(keyboard.FAST_SCAN_INTERVAL)
+					if keyboard.readColumnDebounced():
+						break
+			return
+		while keyboard.active == True:
+			keyboard.selectNextColumn()
+			await asyncio.sleep(keyboard.SCAN_INTERVAL)
+			keyboard.readColumn()
+
+	# INTERNAL FUNCTION
+	# Drives the connection state machine of an x-plane connection
+	async def _supervise(self, xp):
+		while xp.active == True:
+			try:
+				xp.tick()
+			except OSError as e:
+				print ("X-Plane connection check failed: {}".format(e))
+			await asyncio.sleep(xp.TICK_INTERVAL)
+
+	# INTERNAL FUNCTION
+	# Creates the datagram endpoints and tasks for all attached panels
+	async def _start(self):
+		for xp in self.connections:
+			transport, protocol = await self.loop.create_datagram_endpoint(lambda: BeaconProtocol(xp.beacon, self.loop), sock=xp.beacon.sock)
+			self.transports.append(transport)
+			transport, protocol = await self.loop.create_datagram_endpoint(lambda: XPlaneProtocol(xp), sock=xp.sock)
+			self.transports.append(transport)
+			self.tasks.append(self.loop.create_task(self._supervise(xp)))
+		for keyboard in self.keyboards:
+			self.tasks.append(self.loop.create_task(self._scanKeyboard(keyboard)))
+		if self.dbg >=1:
+			print ("Runtime started with {} connection(s) and {} keyboard(s)".format(len(self.connections), len(self.keyboards)))
+
+	# EXPORTED FUNCTION
+	# Runs the event loop until <stop> is called or the process is interrupted
+	def run(self):
+		self.loop.run_until_complete(self._start())
+		self.loop.run_forever()
+
+	# EXPORTED FUNCTION
+	# Stops the event loop. May be called from any thread
+	def stop(self):
+		self.loop.call_soon_threadsafe(self.loop.stop)
+
+	# EXPORTED FUNCTION
+	# Cancels all tasks and closes the transports. Must be called after the loop has stopped and the panels have been stopped
+	def close(self):
+		for task in self.tasks:
+			task.cancel()
+		for transport in self.transports:
+			transport.abort()
+		self.loop.run_until_complete(asyncio.sleep(0))
+		self.loop.close()
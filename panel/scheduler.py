@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+# This class decouples requesting a redraw from performing it. Any thread may call <request> as often as it likes, the
+# render function is called from the scheduler thread at most <rate> times per second, once for all requests which
+# arrived since the previous frame.
+class RenderScheduler(threading.Thread):
+	# default frame rate cap in frames per second
+	DEFAULT_RATE = 60.0
+
+	def __init__(self, render, rate=None):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.active = True
+		self.render = render
+		self.interval = 1.0 / (rate if rate else self.DEFAULT_RATE)
+		self.cond = threading.Condition()
+		self.pending = False
+		self.last_frame = 0.0
+		self.frames = 0
+		self.requests = 0
+		self.errors = 0
+
+	# EXPORTED FUNCTION
+	# Marks the state as dirty. Returns immediately, the redraw happens with the next frame
+	def request(self):
+		with self.cond:
+			self.requests += 1
+			if not self.pending:
+				self.pending = True
+				self.cond.notify()
+
+	def stop(self):
+		with self.cond:
+			self.active = False
+			self.cond.notify()
+
+	def run(self):
+		while self.active == True:
+			with self.cond:
+				while self.active and not self.pending:
+					self.cond.wait()
+				if not self.active:
+					break
+			# respect the frame rate cap, requests arriving meanwhile are served by this frame
+			wait = self.last_frame + self.interval - time.monotonic()
+			if wait > 0.0:
+				time.sleep(wait)
+			with self.cond:
+				self.pending = False
+			self.last_frame = time.monotonic()
+			self.frames += 1
+			try:
+				self.render()
+			except Exception as e:
+				# a failing frame must not stop the redraws. The displays only mark what has been written, so the next
+				# request sends everything which is still missing
+				self.errors += 1
+				print ("Render failed: {!r}".format(e))
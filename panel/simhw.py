@@ -0,0 +1,360 @@
+import heapq
+import threading
+import time
+
+
+# Virtual time for the simulated hardware. Scripted input changes are scheduled at virtual times and executed in order
+# when the clock is advanced. <advance> jumps instantly, <play> follows the real time (optionally sped up), so that
+# threads which poll the pins, like the keyboard scanner, see every level for long enough.
+class VirtualClock:
+
+	def __init__(self, start=0.0):
+		self.now = start
+		self.lock = threading.RLock()
+		# heap of (time, sequence, function, arguments)
+		self.events = []
+		self.sequence = 0
+
+	# returns the current virtual time in seconds, like time.monotonic
+	def monotonic(self):
+		return self.now
+
+	# calls func(*args) when the clock reaches the virtual time <at>
+	def schedule(self, at, func, *args):
+		with self.lock:
+			self.sequence += 1
+			heapq.heappush(self.events, (at, self.sequence, func, args))
+
+	# returns the virtual time of the next scheduled event or None
+	def pending(self):
+		with self.lock:
+			return self.events[0][0] if self.events else None
+
+	# executes all events up to the current time plus <dt> and moves the clock forward by <dt>
+	def advance(self, dt):
+		self.runUntil(self.now + dt)
+
+	def runUntil(self, until):
+		while True:
+			with self.lock:
+				if not self.events or self.events[0][0] > until:
+					break
+				(at, seq, func, args) = heapq.heappop(self.events)
+				self.now = max(self.now, at)
+			func(*args)
+		self.now = max(self.now, until)
+
+	# advances the clock in real time by <dt> virtual seconds, <speed> virtual seconds per real second
+	def play(self, dt, speed=1.0):
+		until = self.now + dt
+		while True:
+			at = self.pending()
+			if at is None or at > until:
+				break
+			if at > self.now:
+				time.sleep((at - self.now) / speed)
+			self.runUntil(at)
+		if until > self.now:
+			time.sleep((until - self.now) / speed)
+		self.runUntil(until)
+
+
+# Simulation of the RPi.GPIO module. Output levels are set by the panel code, input levels result from the pull
+# resistors, from levels driven by a script and from closed contacts between an output and an input pin, e.g. the keys of
+# a key matrix. Edge callbacks are called synchronously from the thread which caused the level change.
+#
+#	gpio = hardware.select(hardware.SIM)
+#	gpio.pressKey(13, 19)					# key between column pin 13 and row pin 19
+#	gpio.turn(17, 27, 3, 0.3)				# three detents to the right within 300 ms
+#	gpio.clock.advance(1.0)
+class SimGPIO:
+	BCM = 11
+	BOARD = 10
+	OUT = 0
+	IN = 1
+	LOW = 0
+	HIGH = 1
+	PUD_OFF = 20
+	PUD_DOWN = 21
+	PUD_UP = 22
+	RISING = 31
+	FALLING = 32
+	BOTH = 33
+
+	def __init__(self, clock):
+		self.clock = clock
+		self.lock = threading.RLock()
+		self.mode = None
+		self.directions = {}
+		self.pulls = {}
+		# levels set with output
+		self.outputs = {}
+		# levels driven from outside with drive
+		self.external = {}
+		# closed contacts as pin -> set of connected pins
+		self.contacts = {}
+		# pin -> [edge, callback, bouncetime in seconds, time of the last event]
+		self.detects = {}
+		# last computed level of every pin with event detection
+		self.levels = {}
+		self.edges = 0
+
+	def setmode(self, mode):
+		self.mode = mode
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+		with self.lock:
+			self.directions[pin] = direction
+			self.pulls[pin] = pull_up_down
+			if direction == self.OUT:
+				self.outputs[pin] = initial if initial is not None else self.LOW
+			self._update()
+
+	def output(self, pin, level):
+		with self.lock:
+			self.outputs[pin] = level
+			self._update()
+
+	def input(self, pin):
+		with self.lock:
+			return self._level(pin)
+
+	def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+		with self.lock:
+			self.detects[pin] = [edge, callback, (bouncetime or 0) / 1000.0, None]
+			self.levels[pin] = self._level(pin)
+
+	def add_event_callback(self, pin, callback):
+		self.detects[pin][1] = callback
+
+	def remove_event_detect(self, pin):
+		with self.lock:
+			self.detects.pop(pin, None)
+
+	def cleanup(self, pins=None):
+		with self.lock:
+			self.__init__(self.clock)
+
+	# INTERNAL FUNCTION
+	# Returns the level of a pin. An input is pulled low by a closed contact to an output which is low
+	def _level(self, pin):
+		if self.directions.get(pin) == self.OUT:
+			return self.outputs[pin]
+		if pin in self.external:
+			return self.external[pin]
+		for other in self.contacts.get(pin, ()):
+			if self.directions.get(other) == self.OUT and self.outputs[other] == self.LOW:
+				return self.LOW
+		pull = self.pulls.get(pin)
+		if pull == self.PUD_UP:
+			return self.HIGH
+		return self.LOW
+
+	# INTERNAL FUNCTION
+	# Recomputes the levels of all pins with event detection and calls the callbacks of those with a matching edge
+	def _update(self):
+		now = self.clock.monotonic()
+		for pin, detect in list(self.detects.items()):
+			level = self._level(pin)
+			if level == self.levels[pin]:
+				continue
+			self.levels[pin] = level
+			(edge, callback, bouncetime, last) = detect
+			if edge == self.RISING and level == self.LOW or edge == self.FALLING and level == self.HIGH:
+				continue
+			if last is not None and now - last < bouncetime:
+				continue
+			detect[3] = now
+			self.edges += 1
+			if callback is not None:
+				callback(pin)
+
+	# EXPORTED FUNCTION
+	# Drives an input pin to the given level, e.g. a switch or an encoder contact
+	def drive(self, pin, level):
+		with self.lock:
+			self.external[pin] = level
+			self._update()
+
+	# EXPORTED FUNCTION
+	# Stops driving an input pin, so that it follows its pull resistor again
+	def release(self, pin):
+		with self.lock:
+			self.external.pop(pin, None)
+			self._update()
+
+	# EXPORTED FUNCTION
+	# Closes the contact between the output pin <col> and the input pin <row>, like a pressed key of a key matrix
+	def pressKey(self, col, row):
+		with self.lock:
+			self.contacts.setdefault(col, set()).add(row)
+			self.contacts.setdefault(row, set()).add(col)
+			self._update()
+
+	def releaseKey(self, col, row):
+		with self.lock:
+			self.contacts.get(col, set()).discard(row)
+			self.contacts.get(row, set()).discard(col)
+			self._update()
+
+	# EXPORTED FUNCTION
+	# Schedules a key press at virtual time <at> (default: now) which lasts <duration> seconds
+	def tapKey(self, col, row, duration=0.1, at=None):
+		at = self.clock.now if at is None else at
+		self.clock.schedule(at, self.pressKey, col, row)
+		self.clock.schedule(at + duration, self.releaseKey, col, row)
+
+	# EXPORTED FUNCTION
+	# Schedules a press of the push button on <pin> at virtual time <at> which lasts <duration> seconds
+	def click(self, pin, duration=0.1, at=None):
+		at = self.clock.now if at is None else at
+		self.clock.schedule(at, self.drive, pin, self.LOW)
+		self.clock.schedule(at + duration, self.release, pin)
+
+	# EXPORTED FUNCTION
+	# Schedules the toggle of a switch on <pin> at virtual time <at>. A closed switch pulls the pin low
+	def toggle(self, pin, at=None):
+		at = self.clock.now if at is None else at
+		def flip():
+			self.drive(pin, self.HIGH if self.input(pin) == self.LOW else self.LOW)
+		self.clock.schedule(at, flip)
+
+	# EXPORTED FUNCTION
+	# Schedules the quadrature waveform of an encoder with the contacts <pin_a> and <pin_b> turning <detents> detents in
+	# <duration> seconds, starting at virtual time <at>. Positive detents turn right, negative ones left. Each detent runs
+	# through the four states of the gray code, starting and ending in the rest state with both contacts open (high)
+	def turn(self, pin_a, pin_b, detents, duration, at=None, steps_per_detent=4):
+		at = self.clock.now if at is None else at
+		# right turn: 11 -> 01 -> 00 -> 10 -> 11
+		sequence = ((0, 1), (0, 0), (1, 0), (1, 1))
+		if detents < 0:
+			sequence = ((1, 0), (0, 0), (0, 1), (1, 1))
+		count = abs(detents) * steps_per_detent
+		if count == 0:
+			return
+		interval = duration / count
+		for i in range(count):
+			(a, b) = sequence[i % len(sequence)]
+			self.clock.schedule(at + i * interval, self._quadrature, pin_a, a, pin_b, b)
+
+	def _quadrature(self, pin_a, a, pin_b, b):
+		with self.lock:
+			if self.input(pin_a) != a:
+				self.drive(pin_a, a)
+			if self.input(pin_b) != b:
+				self.drive(pin_b, b)
+
+
+# Simulated SPI device, which records every transaction and decodes the MAX7219 register writes of a daisy chain. The
+# n-th register/data pair of a transaction is assigned to device n, just like the Lcd class numbers its devices.
+class RecordingSpiDev:
+	# MAX7219 registers
+	NOOP = 0x00
+	DIGIT0 = 0x01
+	DECODE_MODE = 0x09
+	INTENSITY = 0x0a
+	SCAN_LIMIT = 0x0b
+	SHUTDOWN = 0x0c
+	DISPLAY_TEST = 0x0f
+
+	def __init__(self, history=1000):
+		self.max_speed_hz = 0
+		self.lsbfirst = False
+		self.mode = 0
+		self.bits_per_word = 8
+		self.cshigh = False
+		self.opened = None
+		self.history = history
+		self.log = []
+		# device number -> register -> value
+		self.registers = {}
+		self.transactions = 0
+		self.bytes = 0
+		self.written = threading.Condition()
+
+	def open(self, bus, device):
+		self.opened = (bus, device)
+
+	def close(self):
+		self.opened = None
+
+	def writebytes(self, data):
+		data = list(data)
+		with self.written:
+			self.transactions += 1
+			self.bytes += len(data)
+			if self.history:
+				self.log.append(data)
+				del self.log[:-self.history]
+			for devno in range(len(data) // 2):
+				reg = data[2*devno]
+				if reg != self.NOOP:
+					self.registers.setdefault(devno, {})[reg] = data[2*devno + 1]
+			self.written.notify_all()
+
+	def xfer2(self, data):
+		self.writebytes(data)
+		return [0] * len(data)
+
+	xfer = xfer2
+
+	# resets the counters and the transaction log
+	def reset(self):
+		with self.written:
+			self.transactions = 0
+			self.bytes = 0
+			self.log = []
+
+	# waits until more than <transactions> transactions have been written or the timeout expired. Returns the count
+	def waitFor(self, transactions, timeout=None):
+		with self.written:
+			self.written.wait_for(lambda: self.transactions > transactions, timeout)
+			return self.transactions
+
+	# returns the raw segment values of the 8 digit registers of the given device
+	def digits(self, devno):
+		registers = self.registers.get(devno, {})
+		return [registers.get(self.DIGIT0 + i, 0) for i in range(8)]
+
+	# returns the text shown on the first <count> digits of the given device. Ambiguous glyphs are shown as digits
+	def text(self, devno, count=6):
+		glyphs = segmentGlyphs()
+		text = ""
+		for value in self.digits(devno)[:count]:
+			text += glyphs.get(value & 0x7f, "?")
+			if value & 0x80:
+				text += "."
+		return text
+
+	# returns True if the given device is switched on and not in test mode
+	def isOn(self, devno):
+		registers = self.registers.get(devno, {})
+		return registers.get(self.SHUTDOWN) == 1 and registers.get(self.DISPLAY_TEST, 0) == 0
+
+
+# Replacement for the spidev module. The devices created are kept in <devices>
+class SimSpiModule:
+
+	def __init__(self):
+		self.devices = []
+
+	def SpiDev(self):
+		dev = RecordingSpiDev()
+		self.devices.append(dev)
+		return dev
+
+
+_glyphs = None
+
+# returns the reverse of the segment lookup table of the Lcd class. Digits are preferred for ambiguous glyphs
+def segmentGlyphs():
+	global _glyphs
+	if _glyphs is None:
+		from panel.max7219 import CHAR_LOOKUP
+		_glyphs = {}
+		for char, value in CHAR_LOOKUP.items():
+			_glyphs.setdefault(value, char)
+	return _glyphs
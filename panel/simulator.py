@@ -0,0 +1,225 @@
+import argparse
+import heapq
+import random
+import select
+import socket
+import struct
+import time
+
+
+# This class is a stand-in for X-Plane, which speaks the subset of the UDP protocol used by this project. It multicasts
+# the BECN beacon, accepts RREF subscriptions and streams the requested values at their rates and applies DREF writes to
+# its own value table. Of the CMND commands the standby flips of the radios are known. Packet loss, jitter and the way
+# values change can be configured, so that the receiver can be load tested without a running simulator.
+#
+# Run it with:  python -m panel.simulator --help
+class XPlaneSimulator:
+	# value change patterns
+	STATIC = "static"	# values only change when written with DREF
+	RAMP = "ramp"		# each value is incremented with every transmission
+	RANDOM = "random"	# each value is set to a random number with probability <change> per transmission
+	PATTERNS = (STATIC, RAMP, RANDOM)
+
+	MCAST_GRP = "239.255.1.1"
+	MCAST_PORT = 49707
+
+	def __init__(self, port=49000, hostname="localhost", loss=0.0, jitter=0.0, pattern=STATIC, change=0.1, max_values=183, beacon_interval=1.0, dbg=0):
+		self.dbg = dbg
+		self.active = True
+		self.port = port
+		self.hostname = hostname
+		self.loss = loss
+		self.jitter = jitter
+		self.pattern = pattern
+		self.change = change
+		self.max_values = max_values
+		self.beacon_interval = beacon_interval
+		self.random = random.Random(0)
+		# dataref -> current value
+		self.values = {}
+		# subscriber address -> { idx: freq }
+		self.subscriptions = {}
+		# (subscriber address, freq) -> { idx: dataref } of all datarefs streamed together
+		self.streams = {}
+		# (subscriber address, freq) -> time of the next transmission
+		self.schedule = {}
+		# heap of (time, sequence, packet, address) of packets delayed by jitter
+		self.outgoing = []
+		self.sequence = 0
+		# statistics
+		self.packets_sent = 0
+		self.packets_dropped = 0
+		self.values_sent = 0
+		self.drefs_received = 0
+		self.commands_received = 0
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+		# a large receive buffer, so that bursts of subscriptions are not dropped by the kernel
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+		self.sock.bind(("", port))
+		self.sock.setblocking(False)
+		self.beacon_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+		self.beacon_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+		self.beacon_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+	# sets the initial value of a dataref
+	def setValue(self, dataref, value):
+		self.values[dataref] = float(value)
+
+	# INTERNAL FUNCTION
+	# Builds the beacon message in the format parsed by XPlaneBeaconListener
+	def _beacon(self):
+		# major version, minor version, application host id (1 = X-Plane), version number, role (1 = master), port
+		msg = b"BECN\x00" + struct.pack("<BBiiIH", 1, 1, 1, 115101, 1, self.port)
+		return msg + self.hostname.encode('utf-8') + b"\x00"
+
+	# INTERNAL FUNCTION
+	# Sends a packet, applying packet loss and jitter
+	def _send(self, packet, addr, now):
+		if self.loss > 0.0 and self.random.random() < self.loss:
+			self.packets_dropped += 1
+			return
+		if self.jitter > 0.0:
+			self.sequence += 1
+			heapq.heappush(self.outgoing, (now + self.random.uniform(0.0, self.jitter), self.sequence, packet, addr))
+			return
+		self._transmit(packet, addr)
+
+	def _transmit(self, packet, addr):
+		try:
+			self.sock.sendto(packet, addr)
+			self.packets_sent += 1
+		except OSError:
+			self.packets_dropped += 1
+
+	# INTERNAL FUNCTION
+	# Returns the value of the dataref for the next transmission, advancing it according to the change pattern
+	def _evolve(self, dataref):
+		value = self.values.get(dataref, 0.0)
+		if self.pattern == self.RAMP:
+			value = value + 1.0
+		elif self.pattern == self.RANDOM:
+			if self.random.random() < self.change:
+				value = float(self.random.randint(0, 99999))
+		self.values[dataref] = value
+		return value
+
+	# INTERNAL FUNCTION
+	# Handles an incoming RREF or DREF request
+	def _handle(self, data, addr):
+		if data[0:5] == b"RREF\x00" and len(data) >= 13:
+			(freq, idx) = struct.unpack_from("<ii", data, 5)
+			dataref = data[13:].split(b'\x00')[0].decode('utf-8')
+			subs = self.subscriptions.setdefault(addr, {})
+			# remove the index from the stream it was sent with so far
+			old = subs.pop(idx, None)
+			if old is not None:
+				stream = self.streams[(addr, old)]
+				del stream[idx]
+				if not stream:
+					del self.streams[(addr, old)]
+					del self.schedule[(addr, old)]
+			if freq > 0:
+				subs[idx] = freq
+				self.values.setdefault(dataref, 0.0)
+				self.streams.setdefault((addr, freq), {})[idx] = dataref
+				self.schedule.setdefault((addr, freq), time.monotonic())
+			if self.dbg >=1:
+				print ("RREF {} idx {} at {} Hz from {}".format(dataref, idx, freq, addr))
+		elif data[0:5] == b"DREF\x00" and len(data) >= 9:
+			(value,) = struct.unpack_from("<f", data, 5)
+			dataref = data[9:].split(b'\x00')[0].decode('utf-8')
+			self.values[dataref] = value
+			self.drefs_received += 1
+			if self.dbg >=1:
+				print ("DREF {}={}".format(dataref, value))
+		elif data[0:5] == b"CMND\x00":
+			command = data[5:].split(b'\x00')[0].decode('utf-8')
+			self.commands_received += 1
+			# sim/radios/com1_standy_flip swaps sim/cockpit/radios/com1_freq_hz and com1_stdby_freq_hz
+			if command.startswith("sim/radios/") and command.endswith("_standy_flip"):
+				radio = command[len("sim/radios/"):-len("_standy_flip")]
+				active = "sim/cockpit/radios/{}_freq_hz".format(radio)
+				standby = "sim/cockpit/radios/{}_stdby_freq_hz".format(radio)
+				(self.values[active], self.values[standby]) = (self.values.get(standby, 0.0), self.values.get(active, 0.0))
+			if self.dbg >=1:
+				print ("CMND {}".format(command))
+		elif self.dbg >=1:
+			print ("Unknown packet received !", data[0:4])
+
+	# INTERNAL FUNCTION
+	# Sends all RREF streams which are due and returns the time of the next transmission
+	def _stream(self, now):
+		next_time = now + 1.0
+		for key, due in self.schedule.items():
+			(addr, freq) = key
+			if due <= now:
+				items = list(self.streams[key].items())
+				for start in range(0, len(items), self.max_values):
+					chunk = items[start:start + self.max_values]
+					packet = bytearray(b"RREF,")
+					for idx, dataref in chunk:
+						packet += struct.pack("<if", idx, self._evolve(dataref))
+					self.values_sent += len(chunk)
+					self._send(bytes(packet), addr, now)
+				due = max(due + 1.0 / freq, now)
+				self.schedule[key] = due
+			next_time = min(next_time, due)
+		return next_time
+
+	def run(self):
+		next_beacon = 0.0
+		while self.active == True:
+			now = time.monotonic()
+			if now >= next_beacon:
+				try:
+					self.beacon_sock.sendto(self._beacon(), (self.MCAST_GRP, self.MCAST_PORT))
+				except OSError:
+					print ("Beacon could not be sent !")
+				next_beacon = now + self.beacon_interval
+			next_time = min(self._stream(now), next_beacon)
+			while self.outgoing and self.outgoing[0][0] <= now:
+				(t, seq, packet, addr) = heapq.heappop(self.outgoing)
+				self._transmit(packet, addr)
+			if self.outgoing:
+				next_time = min(next_time, self.outgoing[0][0])
+			readable, _, _ = select.select([self.sock], [], [], max(0.0, next_time - time.monotonic()))
+			if readable:
+				try:
+					while True:
+						data, addr = self.sock.recvfrom(2048)
+						self._handle(data, addr)
+				except (BlockingIOError, InterruptedError):
+					pass
+		self.sock.close()
+		self.beacon_sock.close()
+
+	def stop(self):
+		self.active = False
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m panel.simulator", description="X-Plane UDP stand-in for load and latency testing")
+	parser.add_argument("--port", type=int, default=49000, help="UDP port to listen on and to announce in the beacon")
+	parser.add_argument("--hostname", default="localhost", help="host name announced in the beacon")
+	parser.add_argument("--loss", type=float, default=0.0, help="probability for an outgoing packet to be dropped (0..1)")
+	parser.add_argument("--jitter", type=float, default=0.0, help="maximum random delay of an outgoing packet in seconds")
+	parser.add_argument("--pattern", choices=XPlaneSimulator.PATTERNS, default=XPlaneSimulator.STATIC, help="how values change between transmissions")
+	parser.add_argument("--change", type=float, default=0.1, help="probability for a value to change per transmission with --pattern random")
+	parser.add_argument("--max-values", type=int, default=183, help="maximum number of values per RREF packet")
+	parser.add_argument("--set", action="append", default=[], metavar="DATAREF=VALUE", help="initial value of a dataref, may be repeated")
+	parser.add_argument("--debug", type=int, default=0)
+	args = parser.parse_args(argv)
+	sim = XPlaneSimulator(args.port, args.hostname, args.loss, args.jitter, args.pattern, args.change, args.max_values, dbg=args.debug)
+	for item in args.set:
+		(dataref, value) = item.split("=", 1)
+		sim.setValue(dataref, value)
+	print ("Simulating X-Plane on port {}".format(args.port))
+	try:
+		sim.run()
+	except KeyboardInterrupt:
+		print ("quitting...")
+	print ("{} packets sent, {} dropped, {} values sent, {} DREFs and {} commands received".format(sim.packets_sent, sim.packets_dropped, sim.values_sent, sim.drefs_received, sim.commands_received))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,150 @@
+from array import array
+
+
+# Index of the fields of a consumer entry. A consumer is one panel, which uses the dataref of a slot as its own logical
+# variable with its own codec and callback
+OWNER = 0
+NAME = 1
+CODEC = 2
+CALLBACK = 3
+RATE = 4
+
+# Values of the DATA output of x-plane are stored in slots like datarefs. Their key is built from the data group and the
+# position of the value within the group's record
+DATA_PREFIX = "DATA:"
+DATA_VALUES = 8
+
+
+# returns the store key of the value at <index> in the data group <group>
+def dataKey(group, index):
+	return "{}{}:{}".format(DATA_PREFIX, group, index)
+
+
+# returns (group, index) of a key built by dataKey or None for a dataref
+def parseDataKey(key):
+	if not key.startswith(DATA_PREFIX):
+		return None
+	(group, index) = key[len(DATA_PREFIX):].split(":")
+	return (int(group), int(index))
+
+
+# This class holds the current values of all subscribed datarefs. Each dataref lives in a slot, whose number is the
+# index used in the RREF request, so a received value can be stored, compared and dispatched using plain list indexing.
+# Several consumers may share a slot, the dataref is subscribed once with the highest rate any of them needs.
+class DatarefStore:
+
+	def __init__(self):
+		self.clear()
+
+	# removes all slots
+	def clear(self):
+		# current values as received from x-plane (32 bit floats, exactly as transmitted)
+		self.values = array('f')
+		# parallel tables for the dataref string, the consumers and the subscribed RREF rate of each slot
+		self.datarefs = []
+		self.consumers = []
+		self.rates = []
+		# codec of the first consumer of each slot, used by the batch decoder
+		self.codecs = []
+		# reverse lookup from dataref string to slot, only used for subscription bookkeeping
+		self.index = {}
+		# dataref string -> slot of freed slots, so that a dataref which comes back gets its old slot again
+		self.retired = {}
+		# incremented on every change of the slot layout, so that derived tables know when to rebuild
+		self.generation = getattr(self, "generation", 0) + 1
+
+	def __len__(self):
+		return len(self.values)
+
+	# returns the slot of the given dataref or None if it is not stored
+	def find(self, dataref):
+		return self.index.get(dataref)
+
+	# adds a new dataref with a first consumer and returns its slot number. Freed slots are only reused for the dataref
+	# they have been freed by, so an index which is still in flight from x-plane can never be mistaken for a different dataref
+	def add(self, name, dataref, codec, callback=None, owner=None, rate=0):
+		idx = self.retired.pop(dataref, None)
+		if idx is None:
+			idx = len(self.values)
+			self.values.append(0.0)
+			self.datarefs.append(dataref)
+			self.consumers.append([])
+			self.rates.append(0)
+			self.codecs.append(None)
+		else:
+			self.values[idx] = 0.0
+			self.datarefs[idx] = dataref
+			self.consumers[idx] = []
+			self.rates[idx] = 0
+		self.index[dataref] = idx
+		self.attach(idx, owner, name, codec, callback, rate)
+		return idx
+
+	# adds the consumer <owner> to the given slot or replaces its entry. If a new consumer is added or the entry changes
+	# the variable or the codec, the stored value is invalidated, so the next value received for the slot is dispatched
+	def attach(self, idx, owner, name, codec, callback=None, rate=0):
+		consumers = self.consumers[idx]
+		for entry in consumers:
+			if entry[OWNER] is owner:
+				if entry[NAME] != name or entry[CODEC] is not codec:
+					self.values[idx] = float('nan')
+				entry[NAME:] = [name, codec, callback, rate]
+				break
+		else:
+			consumers.append([owner, name, codec, callback, rate])
+			if len(consumers) > 1:
+				self.values[idx] = float('nan')
+		self.codecs[idx] = consumers[0][CODEC]
+		self.generation += 1
+
+	# removes the consumer <owner> from the given slot. Returns the number of remaining consumers
+	def detach(self, idx, owner):
+		consumers = self.consumers[idx]
+		consumers[:] = [entry for entry in consumers if entry[OWNER] is not owner]
+		self.codecs[idx] = consumers[0][CODEC] if consumers else None
+		self.generation += 1
+		return len(consumers)
+
+	# returns the consumer entry of <owner> in the given slot or None
+	def consumer(self, idx, owner):
+		for entry in self.consumers[idx]:
+			if entry[OWNER] is owner:
+				return entry
+		return None
+
+	# returns the highest rate any consumer of the given slot wants
+	def wantedRate(self, idx):
+		return max([entry[RATE] for entry in self.consumers[idx]], default=0)
+
+	# frees the given slot. Values received for it afterwards will be treated as unknown
+	def remove(self, idx):
+		dataref = self.datarefs[idx]
+		if dataref is not None:
+			del self.index[dataref]
+			self.retired[dataref] = idx
+		self.datarefs[idx] = None
+		self.consumers[idx] = []
+		self.codecs[idx] = None
+		self.rates[idx] = 0
+		self.generation += 1
+
+	# returns a dict of data group -> list of the DATA_VALUES slots of the values in the group's record, None for the
+	# values which are not stored
+	def dataTable(self):
+		table = {}
+		for idx, key in enumerate(self.datarefs):
+			if key is not None and key.startswith(DATA_PREFIX):
+				(group, index) = parseDataKey(key)
+				table.setdefault(group, [None] * DATA_VALUES)[index] = idx
+		return table
+
+	# returns True if the given slot is in use
+	def isValid(self, idx):
+		return 0 <= idx < len(self.values) and self.datarefs[idx] is not None
+
+	# sets the callback of <owner> for all slots which are connected to the given logical variable
+	def setCallback(self, name, callback, owner=None):
+		for consumers in self.consumers:
+			for entry in consumers:
+				if entry[OWNER] is owner and entry[NAME] == name:
+					entry[CALLBACK] = callback
@@ -1,308 +1,1027 @@
 from panel.config import config
+from panel.batch import BatchDecoder
 from panel.beacon import XPlaneBeaconListener
+from panel.capture import IN, OUT, XPLANE
+from panel.metrics import registry
+from panel.store import DatarefStore, NAME, CODEC, CALLBACK, RATE, DATA_VALUES, parseDataKey
+import math
+import os
 import socket
+import select
 import struct
 import sys
 import threading
+import time
 
+
+# the values of RREF and DREF packets
+FLOAT32 = struct.Struct("<f")
+
+
+# This class queues outgoing dataref writes. Writes to the same dataref are coalesced, only the last value is kept, and each dataref
+# is sent at most with its configured rate. The first write after a quiet period is sent immediately, the last pending value is sent
+# as soon as the rate allows, so the final value always arrives in x-plane. Writes may carry the time of the input which caused
+# them, the time until the value has been sent is recorded as latency.
+class DrefWriter(threading.Thread):
+	# default maximum send rate per dataref in Hz
+	DEFAULT_RATE = 20.0
+
+	def __init__(self, send, rate=None):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.active = True
+		self.send = send
+		self.rate = rate if rate else self.DEFAULT_RATE
+		self.cond = threading.Condition()
+		# dataref -> (value, minimum interval, time of the oldest input not sent yet)
+		self.pending = {}
+		# dataref -> time of the last transmission
+		self.last_sent = {}
+		self.latency = registry.histogram("latency.input_to_dref")
+		self.m_failed = registry.counter("xplane.drefs_failed")
+
+	# EXPORTED FUNCTION
+	# Queues the given value for the dataref. <rate> is the maximum send rate in Hz, the default rate is used if it is not given.
+	# <origin> is the time.monotonic() timestamp of the input which caused the write
+	def write(self, dataref, value, rate=None, origin=None):
+		if not rate:
+			rate = self.rate
+		with self.cond:
+			if dataref in self.pending:
+				# a coalesced value is as late as the oldest input it replaces
+				older = self.pending[dataref][2]
+				if older is not None and (origin is None or older < origin):
+					origin = older
+			self.pending[dataref] = (value, 1.0 / rate, origin)
+			self.cond.notify()
+
+	# INTERNAL FUNCTION
+	# Sends a value and records the latency of the input which caused it. Send errors are logged and the value is dropped
+	def _send(self, dataref, value, origin):
+		try:
+			self.send(dataref, value)
+		except OSError as e:
+			# the value is lost like a dropped datagram, the writer must keep running for the next ones
+			self.m_failed.add()
+			print ("Sending {} failed: {}".format(dataref, e))
+			return
+		if origin is not None:
+			self.latency.observe(time.monotonic() - origin)
+
+	# EXPORTED FUNCTION
+	# Sends all pending values immediately, regardless of their rate. With <datarefs> only the values of these datarefs are
+	# sent. Values are sent with the lock held, so a caller holding <cond> can send a datagram which must follow them
+	def flush(self, datarefs=None):
+		with self.cond:
+			due = [(dataref, value, origin) for dataref, (value, interval, origin) in self.pending.items() if datarefs is None or dataref in datarefs]
+			now = time.monotonic()
+			for dataref, value, origin in due:
+				del self.pending[dataref]
+				self.last_sent[dataref] = now
+			for dataref, value, origin in due:
+				self._send(dataref, value, origin)
+
+	def stop(self):
+		with self.cond:
+			self.active = False
+			self.cond.notify()
+
+	# INTERNAL FUNCTION
+	# Removes all pending values which may be sent now from the queue. Returns the list of (dataref, value, origin) to send and the
+	# time in seconds until the next pending value becomes due, or None if nothing else is pending. Must be called with the lock held.
+	def _collect(self):
+		now = time.monotonic()
+		due = []
+		timeout = None
+		for dataref, (value, interval, origin) in self.pending.items():
+			wait = self.last_sent.get(dataref, 0.0) + interval - now
+			if wait <= 0.0:
+				due.append((dataref, value, origin))
+			elif timeout is None or wait < timeout:
+				timeout = wait
+		for dataref, value, origin in due:
+			del self.pending[dataref]
+			self.last_sent[dataref] = now
+		return due, timeout
+
+	def run(self):
+		while self.active == True:
+			with self.cond:
+				due, timeout = self._collect()
+				# sent with the lock held, so that nothing can be sent between collecting and sending a value
+				for dataref, value, origin in due:
+					self._send(dataref, value, origin)
+				if not due and self.active:
+					self.cond.wait(timeout)
+
+
+# This class is the connection to x-plane. It owns the UDP socket, the beacon listener and the dataref store and can be
+# shared by several panels, e.g. the RMPs of both pilots. Each panel talks to it through its own XPlaneClient, which knows
+# the profile of the panel. Subscriptions are reference counted: a dataref is requested once with the highest rate any
+# panel wants and every received value is decoded and dispatched to all panels which use the dataref.
+#
+# The connection does not wait for the beacon. It starts with the x-plane host of the last session, which is kept in
+# HOST_FILE, and the subscriptions themselves are the probe: x-plane answers them with the first RREF packet. While no
+# packet arrives, the subscriptions are sent again with exponential backoff. The connection is alive as long as packets
+# arrive, it is considered lost after LIVENESS_TIMEOUT without any, e.g. when the sim has been restarted and has forgotten
+# the subscriptions. A beacon of a different host moves the connection there at once.
 class xplane(threading.Thread):
+	# largest possible UDP datagram
+	RECV_BUFSIZE = 65535
+	# state of the connection
+	PROBING = 1			# subscriptions sent, waiting for the first packet
+	CONNECTED = 2		# packets are arriving
+	# x-plane host used if none is known from a previous session
+	DEFAULT_HOST = ("127.0.0.1", 49000)
+	HOST_FILE = "config/__cfgcache__/xplane_host"
+	# backoff of the probes in seconds
+	PROBE_MIN = 0.25
+	PROBE_MAX = 8.0
+	# seconds without a packet after which the connection is lost. Subscribed datarefs arrive at least once per second
+	LIVENESS_TIMEOUT = 2.5
+	# interval in seconds at which the state is checked when no packet arrives
+	TICK_INTERVAL = 0.25
 
-	def __init__(self, cnf, dbg=0):
+	# All datagrams are written to <capture>, a panel.capture.CaptureWriter, if one is given. The last x-plane host is
+	# kept in <hostfile>, None disables it. With <sock> the connection is offline, e.g. for benchmarks and replays: the
+	# datagrams are sent to <sock>, which only needs a sendto method, there is no beacon listener and it is never started
+	def __init__(self, dbg=0, batch=False, capture=None, hostfile=HOST_FILE, sock=None):
 		threading.Thread.__init__(self)
 		self.active = True
 		self.debug = dbg
-		# Initialize the config file parser
-		self.cfg = cnf
-		# start listening for the X-Plane beacon, which tells us where x-plane is currently running
-		self.beacon = XPlaneBeaconListener()
-		self.beacon.registerChangeEvent(self.xPlaneHostChange)
-		self.beacon.start()
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-		self.sock.settimeout(3.0)
-		self.UDP_XPL = ("localhost", 49009)
+		self.capture = capture
+		if sock is None:
+			# start listening for the X-Plane beacon, which tells us where x-plane is currently running
+			self.beacon = XPlaneBeaconListener(capture=capture)
+			self.beacon.registerChangeEvent(self.xPlaneHostChange)
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+			self.sock.settimeout(self.TICK_INTERVAL)
+		else:
+			self.beacon = None
+			self.sock = sock
+		self._initLink(hostfile)
+		self.UDP_XPL = self._loadHost()
 		self.UDP_LCL = ("", 49009)
-		self.sock.bind(self.UDP_LCL)
+		if sock is None:
+			self.sock.bind(self.UDP_LCL)
+		# outgoing dataref writes are coalesced and rate limited
+		self.writer = DrefWriter(self._sendValue)
 		# prepare all internal lookup tables for datarefs and callbacks
-		self.datarefs = {}
-		self.datarefidx = 0
-		self.xplaneValues = {}
-		self.callbacks = {}
+		self.store = DatarefStore()
+		# data group -> slots of its values, rebuilt when the layout of the store changes
+		self.dataTable = {}
+		self.dataGeneration = None
+		# protects the subscription bookkeeping, clients may subscribe from different threads
+		self.lock = threading.RLock()
+		self.clients = []
+		self._initMetrics()
+		# optionally decode complete RREF packets with numpy
+		self.batch = None
+		if batch:
+			if BatchDecoder.available():
+				self.batch = BatchDecoder(self.store)
+			else:
+				print ("numpy not available, falling back to the standard decoder")
 
 	# EXPORTED FUNCTION
-	# This function is used by the user of this class and registers a callback function for a particular variable.
-	# The variable is a logical variable name, which will internally be translated into an xplane variable using a lookup table
-	def setCallback(self, var, cbk):
-		# lookup the dataref value which is related to the given variable
-		if var in self.cfg.getRequests().keys():
-			dataref = self.cfg.getRequests()[var]
-			if self.debug >=2:
-				print ("Setting callback for variable %s"%dataref)
-			self.callbacks[dataref] = cbk
-		else:
-			if self.debug >=1:
-				print("Callback for variable %s cannot be set."% var)
+	# Starts the beacon listener, the writer and the receiver thread
+	def start(self):
+		self.beacon.start()
+		self.writer.start()
+		threading.Thread.start(self)
+
+	# INTERNAL FUNCTION
+	# Initializes the connection state machine. The first probe is the subscription of the first dataref
+	def _initLink(self, hostfile=None):
+		self.hostfile = hostfile
+		self.state = self.PROBING
+		now = time.monotonic()
+		self.probeStart = now
+		self.lastReceived = now
+		self.backoff = self.PROBE_MIN
+		self.nextProbe = now + self.PROBE_MIN
+		self.m_probes = registry.counter("xplane.probes")
+		self.m_lost = registry.counter("xplane.connections_lost")
+		self.m_connect = registry.histogram("latency.connect")
+		self.m_send_errors = registry.counter("xplane.send_errors")
+		# errno of the last failed send, None after a successful one
+		self.sendError = None
+
+	# INTERNAL FUNCTION
+	# Returns the x-plane host of the last session or the default host
+	def _loadHost(self):
+		if self.hostfile is not None:
+			try:
+				with open(self.hostfile) as f:
+					(host, port) = f.read().split()
+				return (host, int(port))
+			except (OSError, ValueError):
+				pass
+		return self.DEFAULT_HOST
+
+	# INTERNAL FUNCTION
+	# Remembers the current x-plane host for the next session. Errors only cost the probe on the next start
+	def _saveHost(self):
+		if self.hostfile is None or self._loadHost() == self.UDP_XPL:
+			return
+		try:
+			os.makedirs(os.path.dirname(self.hostfile), exist_ok=True)
+			tmpfile = self.hostfile + ".tmp"
+			with open(tmpfile, "w") as f:
+				f.write("{} {}\n".format(*self.UDP_XPL))
+			os.replace(tmpfile, self.hostfile)
+		except OSError:
+			pass
 
 	# INTERNAL FUNCTION
-	# This function will reinterpret a value received from x-plane into the related logical value which is relevant for the user
-	def _reinterpret(self, var, val):
-		# get the type
-		t_type = self.cfg.getVariableItem(var,"type")
-		if t_type == "bool":
-			if val == 1.0:
-				return True
+	# Looks up the counters of the receive and send paths
+	def _initMetrics(self):
+		self.m_packets = registry.counter("xplane.packets_received")
+		self.m_bytes = registry.counter("xplane.bytes_received")
+		self.m_decoded = registry.counter("xplane.values_decoded")
+		self.m_coalesced = registry.counter("xplane.values_coalesced")
+		self.m_changed = registry.counter("xplane.values_changed")
+		self.m_unknown = registry.counter("xplane.unknown_index")
+		self.m_unmapped = registry.counter("xplane.values_unmapped")
+		self.m_drefs = registry.counter("xplane.drefs_sent")
+		self.m_commands = registry.counter("xplane.commands_sent")
+		self.m_rrefs = registry.counter("xplane.rrefs_sent")
+		self.m_malformed = registry.counter("xplane.packets_malformed")
+
+	# EXPORTED FUNCTION
+	# Returns a new client for a panel with the given configuration
+	def connect(self, cnf):
+		client = XPlaneClient(self, cnf)
+		with self.lock:
+			self.clients.append(client)
+		return client
+
+	# EXPORTED FUNCTION
+	# Removes all subscriptions of the given client
+	def disconnect(self, client):
+		with self.lock:
+			store = self.store
+			for idx, dataref in enumerate(list(store.datarefs)):
+				if dataref is not None and store.consumer(idx, client) is not None:
+					self.unsubscribe(client, dataref)
+			if client in self.clients:
+				self.clients.remove(client)
+
+	# EXPORTED FUNCTION
+	# Subscribes <dataref> for the consumer <owner>, which receives it as logical variable <var> converted with <codec>.
+	# A rate of 0 removes the subscription of the consumer. An RREF request is only sent if the rate of the shared
+	# subscription changes, i.e. when the first consumer arrives, the last one leaves or the highest rate changes.
+	def subscribe(self, owner, var, dataref, codec, callback=None, rate=1):
+		with self.lock:
+			store = self.store
+			idx = store.find(dataref)
+			if rate <= 0:
+				if idx is not None and store.consumer(idx, owner) is not None:
+					store.detach(idx, owner)
+					self._rerate(idx)
+				return
+			if idx is None:
+				idx = store.add(var, dataref, codec, callback, owner, rate)
 			else:
-				return False
-		elif t_type == "float":
-			return float(val)
-		elif t_type == "enum":
-			# get the name of the map
-			t_map = self.cfg.getVariableItem(var,"map")
-			t_val_idx = list(self.cfg.getMap(t_map).values()).index(str(val))
-			return list(self.cfg.getMap(t_map).keys())[t_val_idx]
-		elif t_type == "linear":
-			t_offs = float(self.cfg.getVariableItem(var,"offset"))
-			t_slp  = float(self.cfg.getVariableItem(var,"slope"))
-			# y = offs + m*x   ==> x = (y-offs)/m
-			t_val = (float(val)-t_offs) / t_slp
-			t_min = float(self.cfg.getVariableItem(var, "range_in_min"))
-			t_max = float(self.cfg.getVariableItem(var, "range_in_max"))
-			if t_val < t_min:
-				t_val = t_min
-			elif t_val > t_max:
-				t_val = t_max
-			return t_val
-		else:
-			print ("Unknown error !!!!!!!!")
+				store.attach(idx, owner, var, codec, callback, rate)
+			self._rerate(idx)
+
+	# EXPORTED FUNCTION
+	# Removes the subscription of <dataref> for the consumer <owner>
+	def unsubscribe(self, owner, dataref):
+		self.subscribe(owner, None, dataref, None, None, 0)
+
+	# EXPORTED FUNCTION
+	# Returns the rate the consumer <owner> has subscribed <dataref> with, 0 if it has not subscribed it
+	def subscribedRate(self, owner, dataref):
+		with self.lock:
+			idx = self.store.find(dataref)
+			entry = self.store.consumer(idx, owner) if idx is not None else None
+			return entry[RATE] if entry is not None else 0
+
+	# EXPORTED FUNCTION
+	# Sets the callback of <owner> for the logical variable <var>
+	def setCallback(self, owner, var, cbk):
+		with self.lock:
+			self.store.setCallback(var, cbk, owner)
+
+	# EXPORTED FUNCTION
+	# Executes the x-plane command with the given name, e.g. sim/radios/com1_standy_flip. The command is sent immediately.
+	# Pending writes of the <datarefs> the command works on are sent before it, so it never acts on stale values
+	def command(self, name, datarefs=()):
+		message = b"CMND\x00" + name.encode('utf-8') + b'\x00'
+		if self.debug >= 2:
+			print ('Sending to {}:{} command {}'.format(self.UDP_XPL[0], self.UDP_XPL[1], name))
+		with self.writer.cond:
+			if datarefs:
+				self.writer.flush(datarefs)
+			sent = self._sendto(message)
+		if sent:
+			self.m_commands.add()
+
+	# EXPORTED FUNCTION
+	# Returns the raw value stored for <dataref>, None if it is not subscribed or its value has been invalidated
+	def currentValue(self, dataref):
+		with self.lock:
+			idx = self.store.find(dataref)
+			if idx is None:
+				return None
+			value = self.store.values[idx]
+		return None if math.isnan(value) else value
+
+	# EXPORTED FUNCTION
+	# Queues a value for the given dataref. <rate> is the maximum send rate in Hz, <origin> the time of the causing input
+	def write(self, dataref, value, rate=None, origin=None):
+		self.writer.write(dataref, value, rate, origin)
 
 	def xPlaneHostChange(self, stat, host):
 		if stat == XPlaneBeaconListener.LISTENING:
 			(hostname,hostport) = host
 			if self.debug >=1:
-				print ("X-Plane instance found on %s:%d", hostname, hostport)
-			# start the receiver
-			self.UDP_XPL = (socket.gethostbyname(hostname),hostport)
-			self.UDP_LCL = ("localhost",hostport)
-			self.startReceiver()
-		else:
-			# stop the receiver
+				print ("X-Plane instance found on {}:{}".format(hostname, hostport))
+			try:
+				address = (socket.gethostbyname(hostname.decode('utf-8') if isinstance(hostname, bytes) else hostname), hostport)
+			except (socket.error, UnicodeDecodeError):
+				print ("X-Plane host {} cannot be resolved".format(hostname))
+				return
+			with self.lock:
+				self.UDP_LCL = ("localhost",hostport)
+				if address != self.UDP_XPL or self.state != self.CONNECTED:
+					# probe the announced host at once
+					self.UDP_XPL = address
+					self._probing(time.monotonic())
+		elif self.debug >= 1:
+			# the beacon is only a hint, the connection is alive as long as x-plane sends packets
+			print ("X-Plane beacon lost !")
+
+	# EXPORTED FUNCTION
+	# Drives the connection state machine: sends the next probe when it is due and detects a lost connection. Writes
+	# which are due for a resend are sent again, also while no packet arrives. It is called by the receiver after every
+	# receive cycle and at least every TICK_INTERVAL seconds
+	def tick(self):
+		self._reconcile()
+		now = time.monotonic()
+		if self.state == self.CONNECTED:
+			if now - self.lastReceived > self.LIVENESS_TIMEOUT:
+				if self.debug >= 1:
+					print ("X-Plane signal lost !")
+				self.m_lost.add()
+				with self.lock:
+					self._probing(now)
+		elif now >= self.nextProbe:
+			with self.lock:
+				self._probe(now)
+
+	# INTERNAL FUNCTION
+	# Enters the PROBING state and sends the first probe immediately
+	def _probing(self, now):
+		self.state = self.PROBING
+		self.probeStart = now
+		self.backoff = self.PROBE_MIN
+		self._probe(now)
+
+	# INTERNAL FUNCTION
+	# Sends all subscriptions to the current host and schedules the next probe. A probe which could not be sent, e.g. as
+	# the network is not up yet, is repeated with the next tick without increasing the backoff
+	def _probe(self, now):
+		if self.debug >= 1:
+			print ("Probing X-Plane on {}:{}".format(*self.UDP_XPL))
+		self.m_probes.add()
+		if not self._resubscribe():
+			self.nextProbe = now + self.TICK_INTERVAL
+			return
+		self.nextProbe = now + self.backoff
+		self.backoff = min(self.backoff * 2, self.PROBE_MAX)
+
+	# INTERNAL FUNCTION
+	# Called for every receive cycle, x-plane is alive
+	def _alive(self):
+		now = time.monotonic()
+		self.lastReceived = now
+		if self.state != self.CONNECTED:
+			self.state = self.CONNECTED
+			self.m_connect.observe(now - self.probeStart)
 			if self.debug >= 1:
-				print ("X-Plane signal lost !")
-			self.UDP_XPL = ("localhost", 49009)
-			self.stopReceiver()
+				print ("X-Plane connected on {}:{}".format(*self.UDP_XPL))
+			self._saveHost()
 
 	# EXPORTED FUNCTION
 	# This function must be used to stop receiving from x-plane. It also stops the beacon receiver and closes the socket in order to terminate.
 	def stop(self):
 		# stop the receiver
-		self.stopReceiver()
+		with self.lock:
+			for dataref in list(self.store.datarefs):
+				if dataref is not None:
+					self._request(self.store.find(dataref), 0)
+			self.store.clear()
 		self.active = False
+		# send the last pending values and stop the writer
+		self.writer.flush()
+		self.writer.stop()
 		# stop the beacon
-		self.beacon.stop()
-		# shutdown the socket
-		self.sock.close()
+		if self.beacon is not None:
+			self.beacon.stop()
+			# shutdown the socket
+			self.sock.close()
 
 	# INTERNAL FUNCTION
 	# Send a dataref change to x-plane
 	def _sendValue(self, dataref, value):
 		cmd = b"DREF\x00"
-		string = dataref.encode('utf-8')
-		string+= '\x00'
+		string = dataref.encode('utf-8') + b'\x00'
 		message = struct.pack("<5sf500s", cmd, value, string)
 		assert(len(message)==509)
 		if self.debug >= 2:
 			print ('Sending to {}:{} dataref {}={}'.format(self.UDP_XPL[0], self.UDP_XPL[1], dataref, value))
-		self.sock.sendto(message, self.UDP_XPL)
+		if self._sendto(message):
+			self.m_drefs.add()
 
-	# EXPORTED FUNCTION
-	# This function sends a value to x-plane. It uses the configuration structure to find out how to interpret the 
-	# value to send
-	def setValue(self, var, value):
-		# look up the item in the configuration structure
-		if var in self.cfg.getVariables().keys():
-			if self.debug >=2:
-				print ("Setting item %s to value %s" %(var, str(value)))
-			# item does exist, so lookup the dataref and the type
-			# get the type
-			t_type = self.cfg.getVariableType(var)
-			if t_type == "bool":
-				if value > 0:
-					t_val = 1.0
-				else:
-					t_val = 0.0
-				if self.debug >=2:
-					print ("Now sending {} to {}".format(t_val, self.cfg.getVariables()[var]))
-				self._sendValue(self.cfg.getVariables()[var], float(t_val))
-			elif t_type == "float":
-				if self.debug >=2:
-					print ("Now sending {} to {}".format(value, self.cfg.getVariables()[var]))
-				self._sendValue(self.cfg.getVariables()[var], float(value))
-			elif t_type == "enum":
-				# get the name of the map
-				t_map = self.cfg.getVariableItem(var, "map")
-				t_val = self.cfg.getMap(t_map)[value]
-				self._sendValue(self.cfg.getVariables()[var], float(t_val))
-			elif t_type == "linear":
-				# get min, max values against which we need to clip the input
-				t_min = float(self.cfg.getVariableItem(var, "range_in_min"))
-				t_max = float(self.cfg.getVariableItem(var, "range_in_max"))
-				if float(value) < t_min:
-					value = t_min
-				elif float(value) > t_max:
-					value = t_max
-				# get the offset and the slope to calculate the new value
-				t_offs = float(self.cfg.getVariableItem(var, "offset"))
-				t_slp  = float(self.cfg.getVariableItem(var, "slope"))
-				t_val = t_offs + t_slp*float(value)
-				if self.debug >=2:
-					print ("Now sending {} to {}".format(t_val, self.cfg.getVariables()[var]))
-				self._sendValue(self.cfg.getVariables()[var], float(t_val))
-			else:
-				print ("Invalid mapping table !!!")
-		else:
-			print ('******* setValue: Invalid item {}*******'.format(var))
+	# INTERNAL FUNCTION
+	# Requests the dataref of the given slot with the highest rate of its consumers, if that differs from the rate it is
+	# subscribed with. A slot without consumers is unsubscribed and freed.
+	def _rerate(self, idx):
+		rate = self.store.wantedRate(idx)
+		if rate != self.store.rates[idx]:
+			self._request(idx, rate)
 
 	# INTERNAL FUNCTION
-	# This function will send a dataref request to x-plane. The update frequency is optional and defaults to 1 per second
-	def _request(self, dataref, freq=None):
-		if freq == None:
-			freq = 1
-		# check whether or not this has already been requested
-		if dataref in self.datarefs.values():
-			# yes, it's there so get the index
-			idx = list(self.datarefs.keys()) [list(self.datarefs.values()).index(dataref)]
-			# check if dataref also exists in the xplaneValues
-			if dataref in self.xplaneValues.keys():
-				del self.xplaneValues[dataref]
-			del self.datarefs[idx]
+	# This function will send a dataref request for the given slot to x-plane. A frequency of 0 unsubscribes the dataref
+	# and frees its slot in the value store.
+	def _request(self, idx, freq):
+		dataref = self.store.datarefs[idx]
+		if freq == 0:
+			self.store.remove(idx)
 		else:
-			idx = self.datarefidx
-			self.datarefs[self.datarefidx] = dataref
-			self.datarefidx += 1
-			self.xplaneValues[dataref] = 0
+			self.store.rates[idx] = freq
+		self._sendRequest(dataref, freq, idx)
+
+	# INTERNAL FUNCTION
+	# Sends the RREF request or the data group selection for a slot. Returns False if it could not be sent
+	def _sendRequest(self, dataref, freq, idx):
+		data = parseDataKey(dataref)
+		if data is not None:
+			# the DATA output of a group is selected as long as one of its values is stored
+			group = data[0]
+			slots = self.store.dataTable().get(group, ())
+			selected = [slot for slot in slots if slot is not None and slot != idx and self.store.rates[slot] > 0]
+			if not selected:
+				return self._selectData((group,), freq > 0)
+			return True
 		cmd = b"RREF\x00"
-		string = dataref.encode('utf-8') + '\x00'
+		string = dataref.encode('utf-8') + b'\x00'
 		if self.debug >=1:
 			print ("Requesting dataref %s using index %d" % (dataref, idx))
 		message = struct.pack("<5sii400s", cmd, freq, idx, string)
 		assert(len(message)==413)
 		if self.debug>=2:
 			print ('Sending to {}:{} dataref {}={}'.format(self.UDP_XPL[0], self.UDP_XPL[1], freq, dataref))
-		self.sock.sendto(message, self.UDP_XPL)
+		if not self._sendto(message):
+			return False
+		self.m_rrefs.add()
+		return True
 
 	# INTERNAL FUNCTION
-	# This function will subscribe to all datarefs given in the configuration file listed under the 'Requests' section.
-	def _subscribe(self):
-		for var in list(self.cfg.getRequests().keys()):
-			self._request(self.cfg.getRequests()[var])
+	# Enables (DSEL) or disables (USEL) the UDP output of the given data groups. X-Plane sends them with the rate set on
+	# its data output screen
+	def _selectData(self, groups, select):
+		cmd = b"DSEL\x00" if select else b"USEL\x00"
+		if self.debug >=1:
+			print ("{} data groups {}".format("Selecting" if select else "Deselecting", groups))
+		return self._sendto(cmd + struct.pack("<{}i".format(len(groups)), *groups))
 
 	# INTERNAL FUNCTION
-	# This function will unsubscribe from all datarefs given in the configuration file listed under the 'Requests' section.
-	def _unsubscribe(self):
-		for var in list(self.cfg.getRequests().keys()):
-			self._request(self.cfg.getRequests()[var], 0)
+	# Sends a datagram to x-plane. Returns False if it could not be sent, e.g. while the network is down. Like a lost
+	# datagram this is repaired by the probes and the write reconciliation, so the error is only logged when it changes
+	def _sendto(self, message):
+		if self.capture is not None:
+			self.capture.record(OUT, XPLANE, message)
+		try:
+			self.sock.sendto(message, self.UDP_XPL)
+		except OSError as e:
+			self.m_send_errors.add()
+			if e.errno != self.sendError:
+				self.sendError = e.errno
+				print ("Sending to X-Plane on {}:{} failed: {}".format(self.UDP_XPL[0], self.UDP_XPL[1], e))
+			return False
+		self.sendError = None
+		return True
 
+	# INTERNAL FUNCTION
+	# Requests all subscribed datarefs again, e.g. from a newly found x-plane instance. Returns False if a request could
+	# not be sent
+	def _resubscribe(self):
+		with self.lock:
+			store = self.store
+			for idx, dataref in enumerate(store.datarefs):
+				if dataref is not None and parseDataKey(dataref) is None:
+					if not self._sendRequest(dataref, store.rates[idx], idx):
+						return False
+			groups = list(store.dataTable())
+			if groups:
+				return self._selectData(groups, True)
+			return True
 
-	# EXTERNAL FUNCTION
-	# This function will initiate the receiver function by resubscribing to the dataref values from the config file.
-	def startReceiver(self, callbacks=None):
-		# Subscribe to the datarefs
-		self._subscribe()
-		if callbacks != None:
-			self.callbacks = {}
-			self.setCallbacks(callbacks)
+	# INTERNAL FUNCTION
+	# This function will parse a list of received (index, value) pairs for changes. If changes are found, it will inform all consumers
+	# of the dataref by calling their callback function with the value converted by their codec
+	def _parse(self, retvalues):
+		store = self.store
+		values = store.values
+		for idx, newval in retvalues:		# iterate through the returned values using the RREF index
+			if not store.isValid(idx):
+				self.m_unknown.add()
+				if self.debug >=1:
+					print ("################ Unknown dataref index received %d" % idx)
+				continue
+			orgval = values[idx]
+			if orgval != newval:
+				if self.debug >=1:
+					print ("Value %s has changed from %s to %s." %(store.datarefs[idx], str(orgval), str(newval)))
+				# trigger change notification
+				values[idx] = newval
+				self.m_changed.add()
+				# call the callback functions of all consumers
+				for entry in store.consumers[idx]:
+					cbk = entry[CALLBACK]
+					if cbk is not None:
+						newval_int = entry[CODEC].decode(newval)		# revers interpret the x-plane value into the logical value known to the calling app
+						if self.debug >=3:
+							print ("New value is %s, converting %s"%(newval, newval_int))
+						if newval_int is None:
+							self._unmapped(idx, newval)
+							continue
+						cbk(entry[NAME], newval_int)
+					elif self.debug >=1:
+						print ("No callback for %s" % store.datarefs[idx])
 
-	# EXTERNAL FUNCTION
-	# This function currently does nothing meaningful
-	def stopReceiver(self):
-		self._unsubscribe()
-		self.datarefs = {}
-		self.datarefidx = 0
-		self.xplaneValues = {}
 
-	# EXTERNAL FUNCTION
-	# This function takes an array of tuples which contain the callback functions
-	def setCallbacks(self, callbacks):
-		for id in callbacks.keys():
-			self.setCallback(id, callbacks[id])
+	# INTERNAL FUNCTION
+	# This function informs the consumers about values which have been detected as changed by the batch decoder. It gets a list of
+	# (index, raw value, logical value) tuples. The logical value has been converted with the codec of the first consumer
+	def _dispatch(self, changes):
+		store = self.store
+		self.m_changed.add(len(changes))
+		for idx, newval, newval_int in changes:
+			if self.debug >=1:
+				print ("Value %s has changed to %s." %(store.datarefs[idx], str(newval)))
+			consumers = store.consumers[idx]
+			for entry in consumers:
+				cbk = entry[CALLBACK]
+				if cbk is not None:
+					value = newval_int if entry is consumers[0] else entry[CODEC].decode(newval)
+					if value is None:
+						self._unmapped(idx, newval)
+						continue
+					cbk(entry[NAME], value)
+				elif self.debug >=1:
+					print ("No callback for %s" % store.datarefs[idx])
 
 	# INTERNAL FUNCTION
-	# This function will parse a list of received datarefs for changes. If changes are found, it will inform the user by calling the respective callback function
-	# which has been registered previously be the user of this class using the external function <setCallback>
-	def _parse(self, retvalues):
-		for idx in retvalues:		# iterate through the returned values using the 'dataref' value
-			if idx in self.xplaneValues.keys():
-				orgval = self.xplaneValues[idx]
-				newval = retvalues[idx]
-				if orgval != newval:
-					if self.debug >=1:
-						print ("Value %s has changed from %s to %s." %(str(idx).strip(b'\x00'), str(orgval), str(newval)))
-					# trigger change notification
-					self.xplaneValues[idx] = newval
-					# call callback function if existing
-					if idx in self.callbacks.keys():
-						if self.debug >=1:
-							print ("Calling callback for %s" % idx.strip('\x00'))
-						v1 = list(self.cfg.getRequests().values()).index(idx)
-						v2 = list(self.cfg.getRequests().keys())[v1]
-						newval_int = self._reinterpret(v2, newval)		# revers interpret the x-plane value into the logical value known to the calling app
-						if self.debug >=3:
-							print ("New value is %d, converting %s"%(newval, newval_int))
-						self.callbacks[idx](v2, newval_int)
-					else:
-						if self.debug >=1:
-							print ("No callback for %s" % idx)
-				else:
-					#print ("Value did not change")
-					pass
-			else:
-				self.xplaneValues[idx] = newval
-				print ("################ Unknown dataref received %s" % idx)
+	# Counts a received value which the codec of a consumer cannot convert, e.g. an enum value missing in the map of the
+	# profile. The consumer keeps its last value
+	def _unmapped(self, idx, newval):
+		self.m_unmapped.add()
+		if self.debug >=1:
+			print ("Value %s of %s is not in the map of the variable" % (str(newval), self.store.datarefs[idx]))
 
+	# INTERNAL FUNCTION
+	# This function decodes a single datagram of <nbytes> length from the receive buffer. RREF values are collected in <retvalues>
+	# as index:value pairs, so that a value which has been received several times during one drain cycle only is dispatched once
+	def _decode(self, buf, view, nbytes, retvalues):
+		self.m_packets.add()
+		self.m_bytes.add(nbytes)
+		if self.capture is not None:
+			self.capture.record(IN, XPLANE, view[:nbytes])
+		try:
+			self._decodePacket(view, nbytes, retvalues)
+		except (struct.error, ValueError) as e:
+			# a single malformed datagram must not stop the receiver
+			self.m_malformed.add()
+			print ("Malformed packet dropped:", e)
+
+	# INTERNAL FUNCTION
+	# Decodes the datagram according to its header. The header is only read from the received bytes, the buffer still holds
+	# the rest of earlier and longer datagrams
+	def _decodePacket(self, view, nbytes, retvalues):
+		if nbytes < 5:
+			self.m_malformed.add()
+			if self.debug >= 1:
+				print ("Short packet received !", bytes(view[0:nbytes]))
+			return
+		header = bytes(view[0:4])
+		if header == b"RREF":
+			# we get 8 bytes for each dataref
+			# an integer for the idx and the float value
+			if (nbytes - 5) % 8 != 0:
+				self.m_malformed.add()
+				if self.debug >= 1:
+					print ("Truncated RREF packet of {} bytes received !".format(nbytes))
+				return
+			num_values = (nbytes - 5) // 8
+			self.m_decoded.add(num_values)
+			if self.batch is not None:
+				self.batch.feed(view, nbytes)
+				return
+			known = len(retvalues)
+			for idx, fval in struct.iter_unpack("<if", view[5:5 + num_values*8]):
+				retvalues[idx] = fval
+			# values which have been overwritten by a newer one for the same index are never dispatched
+			self.m_coalesced.add(num_values - (len(retvalues) - known))
+		elif header == b"RPOS":
+			print ("Position information rececived !")
+		elif header == b"DATA":
+			# a record of 36 bytes per data group: the group number and its values as 8 floats
+			num_records = (nbytes - 5) // 36
+			self.m_decoded.add(num_records * DATA_VALUES)
+			if self.batch is not None:
+				self.batch.feedData(view, nbytes)
+				return
+			store = self.store
+			if self.dataGeneration != store.generation:
+				self.dataTable = store.dataTable()
+				self.dataGeneration = store.generation
+			table = self.dataTable
+			for record in struct.iter_unpack("<i8f", view[5:5 + num_records*36]):
+				slots = table.get(record[0])
+				if slots is not None:
+					for idx, fval in zip(slots, record[1:]):
+						if idx is not None:
+							retvalues[idx] = fval
+		else:
+			print ("Unknown packet received !", bytes(view[0:4]))
+
+	# EXPORTED FUNCTION
+	# Handles the datagram <data> as if it had been received from x-plane, e.g. from a capture which is replayed. The values
+	# are dispatched, but the datagram does not count as a sign of life of the x-plane host
+	def feed(self, data):
+		retvalues = {}
+		self._decode(data, memoryview(data), len(data), retvalues)
+		self._complete(retvalues, False)
+
+	# INTERNAL FUNCTION
+	# Finishes a receive cycle: the collected values are parsed, changes dispatched and the writes of the clients which have
+	# not been confirmed by x-plane are checked. Runs on the receiver thread or the event loop after every drain cycle.
+	# <alive> is False for datagrams which have not been received from the host, they leave the connection state alone
+	def _complete(self, retvalues, alive=True):
+		if alive:
+			self._alive()
+		if retvalues:
+			self._parse(retvalues.items())
+		if self.batch is not None:
+			self._dispatch(self.batch.changes())
+		self._reconcile()
+
+	# INTERNAL FUNCTION
+	# Checks the writes of the clients which have not been confirmed by x-plane
+	def _reconcile(self):
+		for client in list(self.clients):
+			if client.inflight:
+				client.reconcile()
 
 	def run(self):
 		if self.debug >=1:
 			print ("Starting receiver loop")
+		# the receive buffer is allocated once and can hold the largest possible UDP datagram, so that even huge RREF bursts are not truncated
+		buf = bytearray(self.RECV_BUFSIZE)
+		view = memoryview(buf)
+		poller = select.poll()
+		poller.register(self.sock, select.POLLIN)
 		while self.active == True:
 			try:
-				# receive a packet
-				data = self.sock.recv(1024)
-				# temporary collection of values
+				# wait for a packet
+				nbytes = self.sock.recv_into(buf)
+				# temporary collection of index:value pairs
 				retvalues = {}
-				# read the header of the message
-				header = data[0:4]
-				if header == b"RREF":
-					# we get 8 bytes for each dataref
-					# an integer for the idx and the float value
-					values = data[5:]
-					num_values = int(len(values)/8)
-
-					# extract all received values
-					for i in range(0, num_values):
-						# extract each individual value from the stream
-						singledata = values[i*8:(i+1)*8]
-						(idx, fval) = struct.unpack("<if", singledata)
-						#print ("Item with index %d found" %idx)
-						if idx in self.datarefs.keys():
-							# retvalues is a map of 'dataref': float_value pairs
-							retvalues[self.datarefs[idx]] = fval
-					# parse the values to find out what changes we received
-					self._parse(retvalues)
-				elif header == b"RPOS":
-					print ("Position information rececived !")
-				elif header == b"DATA":
-					print ("DATA block received !")
-				else:
-					print ("Unknown packet received !", data[0:4])
+				self._decode(buf, view, nbytes, retvalues)
+				# drain all datagrams which are already queued without blocking
+				while poller.poll(0):
+					nbytes = self.sock.recv_into(buf)
+					self._decode(buf, view, nbytes, retvalues)
+				# parse the values to find out what changes we received
+				self._complete(retvalues)
 			except socket.timeout:
-				if self.debug >=1:
-					print ("*********PING********")
 				pass
 			except socket.error:
 				print ("Socket error !")
 				pass
-			except :
-				print ("Bullshit exception")
-				raise
+			except Exception as e:
+				# a failing receive cycle loses its values, the receiver keeps running for all panels of the connection
+				print ("Receive cycle failed: {!r}".format(e))
+			try:
+				self.tick()
+			except OSError as e:
+				print ("X-Plane connection check failed: {}".format(e))
+		view.release()
 		print ("Terminating receiver loop")
 		self.sock.close()
 
+
+# This class is the interface of a single panel to the shared x-plane connection. It translates the logical variables of
+# the panel's profile into datarefs and subscribes the variables shown on the panel with a higher rate.
+#
+# The panel changes its own state before it writes a value, so the RREF echo of the write carries nothing new. While a
+# write is in flight, i.e. not yet seen in the RREF stream, the values received for the variable which are older than
+# the write are held back, as they would make the display jump back during fast tuning. These are the value x-plane had
+# before the write and the values of the earlier writes of the same tuning sequence. Any other value has been set in the
+# sim, it overrules the write and is passed on. Values are compared within half of the small increment of the variable,
+# as x-plane rounds some datarefs, e.g. the frequencies in Hz are integers. A write which is not confirmed within its
+# timeout is sent again, as UDP may drop it. After MAX_RETRIES the write is given up and the last value received from
+# x-plane is passed on.
+class XPlaneClient:
+	# RREF rates in Hz of variables without a 'rate' or 'focus_rate' key
+	DEFAULT_RATE = 1
+	FOCUS_RATE = 10
+	# a write is confirmed when the echo arrives within WRITE_TIMEOUT seconds plus two RREF periods of the variable
+	WRITE_TIMEOUT = 0.25
+	MAX_RETRIES = 3
+
+	# fields of an in-flight write
+	EXPECTED = 0		# logical value x-plane will report, the written value after the float32 round trip
+	RAW = 1				# value written to the dataref
+	DEADLINE = 2		# time.monotonic() at which the write is sent again
+	ATTEMPTS = 3		# number of times the write has been sent
+	TIMEOUT = 4			# seconds to wait for the echo of each attempt
+	TOLERANCE = 5		# largest difference of a received value which still matches, 0 for exact comparison
+	STALE = 6			# logical values which are older than the write
+	# number of older values kept per variable
+	MAX_STALE = 32
+
+	def __init__(self, connection, cnf):
+		self.connection = connection
+		self.debug = connection.debug
+		self.cfg = cnf
+		self.callbacks = {}
+		# variable -> in-flight write, see the field indices above
+		self.inflight = {}
+		self.lock = threading.Lock()
+		self.m_suppressed = registry.counter("xplane.echoes_suppressed")
+		self.m_confirmed = registry.counter("xplane.writes_confirmed")
+		self.m_retried = registry.counter("xplane.writes_retried")
+		self.m_failed = registry.counter("xplane.writes_failed")
+		self.m_overruled = registry.counter("xplane.writes_overruled")
+		# variables which are currently shown on the panel and subscribed with their focus rate
+		self.focus = set()
+		# dataref -> variable of all datarefs subscribed by this client
+		self.subscribed = {}
+
+	# EXPORTED FUNCTION
+	# This function is used by the user of this class and registers a callback function for a particular variable.
+	# The variable is a logical variable name, which will internally be translated into an xplane variable using a lookup table
+	def setCallback(self, var, cbk):
+		# lookup the dataref value which is related to the given variable
+		if var in self.cfg.getSubscriptions():
+			dataref = self.cfg.getSubscriptions()[var]
+			if self.debug >=2:
+				print ("Setting callback for variable %s"%dataref)
+			self.callbacks[var] = cbk
+			self.connection.setCallback(self, var, self._received)
+		else:
+			if self.debug >=1:
+				print("Callback for variable %s cannot be set."% var)
+
+	# EXTERNAL FUNCTION
+	# This function takes an array of tuples which contain the callback functions
+	def setCallbacks(self, callbacks):
+		for id in callbacks.keys():
+			self.setCallback(id, callbacks[id])
+
+	# EXPORTED FUNCTION
+	# This function sends a value to x-plane. It uses the precompiled codec of the variable to find out how to interpret the
+	# value to send. <origin> is the time.monotonic() timestamp of the input which caused the change
+	def setValue(self, var, value, origin=None):
+		# look up the precompiled codec of the item
+		codec = self.cfg.getCodec(var)
+		if codec is not None and codec.dataref is not None:
+			t_val = codec.encode(value)
+			if self.debug >=2:
+				print ("Now sending {} to {}".format(t_val, codec.dataref))
+			self._expect(var, codec, t_val)
+			self.connection.write(codec.dataref, t_val, codec.max_rate, origin)
+		else:
+			print ('******* setValue: Invalid item {}*******'.format(var))
+
+	# EXPORTED FUNCTION
+	# Executes the x-plane command the profile maps to the logical <action>. <values> are the logical values the variables
+	# will have after the command, they are reconciled with the RREF stream like written values, so a lost command is
+	# repaired by writing them. Returns False if the profile has no command for the action
+	def command(self, action, values=None):
+		name = self.cfg.getCommand(action)
+		if name is None:
+			return False
+		datarefs = set()
+		if values is not None:
+			for var, value in values.items():
+				codec = self.cfg.getCodec(var)
+				if codec is not None and codec.dataref is not None:
+					self._expect(var, codec, codec.encode(value))
+					datarefs.add(codec.dataref)
+		self.connection.command(name, datarefs)
+		return True
+
+	# INTERNAL FUNCTION
+	# Records a write of the raw value <t_val> as in flight until it is seen in the RREF stream
+	def _expect(self, var, codec, t_val):
+		if var not in self.callbacks:
+			return
+		# x-plane transmits float32, so the echo is compared with the value after the same rounding
+		expected = codec.decode(FLOAT32.unpack(FLOAT32.pack(t_val))[0])
+		tolerance = self._tolerance(codec)
+		source = self.cfg.getSubscriptions().get(var, codec.dataref)
+		rate = self.connection.subscribedRate(self, source) or self.DEFAULT_RATE
+		timeout = self.WRITE_TIMEOUT + 2.0 / rate
+		current = self.connection.currentValue(source)
+		with self.lock:
+			entry = self.inflight.get(var)
+			if entry is not None:
+				# the previous write of a tuning sequence has not been confirmed yet, its echo is older than this write
+				stale = entry[self.STALE]
+				stale.append(entry[self.EXPECTED])
+				del stale[:-self.MAX_STALE]
+			else:
+				stale = [codec.decode(current)] if current is not None else []
+			self.inflight[var] = [expected, t_val, time.monotonic() + timeout, 1, timeout, tolerance, stale]
+
+	# INTERNAL FUNCTION
+	# Returns the largest difference between a written and a received logical value which still confirms the write: half
+	# of the small increment, or one unit of the dataref for linear variables which are not tuned by increments
+	def _tolerance(self, codec):
+		if codec.type not in ("linear", "float"):
+			return 0.0
+		if codec.increment_lo > 0.0:
+			return codec.increment_lo / 2
+		if codec.type == "linear":
+			return 1.0 / abs(codec.slope)
+		return 0.0
+
+	# INTERNAL FUNCTION
+	# Returns True if the received logical value <value> matches <expected> within <tolerance>
+	def _matches(self, value, expected, tolerance):
+		if tolerance:
+			return abs(value - expected) <= tolerance
+		return value == expected
+
+	# INTERNAL FUNCTION
+	# Receives the changed values of all variables with a callback from the connection. Values of variables with a write
+	# in flight which are older than the write are held back, the echo of the write confirms it
+	def _received(self, var, value):
+		if self.inflight:
+			with self.lock:
+				entry = self.inflight.get(var)
+				if entry is not None:
+					tolerance = entry[self.TOLERANCE]
+					if self._matches(value, entry[self.EXPECTED], tolerance):
+						del self.inflight[var]
+						self.m_confirmed.add()
+						self.m_suppressed.add()
+						return
+					if any(self._matches(value, old, tolerance) for old in entry[self.STALE]):
+						self.m_suppressed.add()
+						return
+					# the value has been changed in the sim after the write, x-plane has the last word
+					del self.inflight[var]
+					self.m_overruled.add()
+		cbk = self.callbacks.get(var)
+		if cbk is not None:
+			cbk(var, value)
+
+	# EXPORTED FUNCTION
+	# Sends the writes again which have not been confirmed in time. Writes which have been sent MAX_RETRIES times are given
+	# up, the panel then gets the last value x-plane has reported. Called by the connection after each receive cycle
+	def reconcile(self):
+		now = time.monotonic()
+		resend = []
+		failed = []
+		with self.lock:
+			for var, entry in list(self.inflight.items()):
+				if now < entry[self.DEADLINE]:
+					continue
+				# a value which x-plane rounds to the value it had before the write is not dispatched as a change
+				if self._confirmedByStore(var, entry):
+					del self.inflight[var]
+					self.m_confirmed.add()
+					continue
+				if entry[self.ATTEMPTS] > self.MAX_RETRIES:
+					del self.inflight[var]
+					failed.append(var)
+				else:
+					entry[self.ATTEMPTS] += 1
+					entry[self.DEADLINE] = now + entry[self.TIMEOUT]
+					resend.append((var, entry[self.RAW]))
+		for var, raw in resend:
+			codec = self.cfg.getCodec(var)
+			if codec is not None and codec.dataref is not None:
+				if self.debug >=1:
+					print ("Write of {} not confirmed, sending it again".format(var))
+				self.m_retried.add()
+				self.connection.write(codec.dataref, raw, codec.max_rate)
+		for var in failed:
+			if self.debug >=1:
+				print ("Write of {} has not been confirmed by x-plane".format(var))
+			self.m_failed.add()
+			codec = self.cfg.getCodec(var)
+			cbk = self.callbacks.get(var)
+			source = self.cfg.getSubscriptions().get(var)
+			value = self.connection.currentValue(source) if codec is not None and source is not None else None
+			value = codec.decode(value) if value is not None else None
+			if value is not None and cbk is not None:
+				cbk(var, value)
+
+	# INTERNAL FUNCTION
+	# Returns True if the value stored for the variable matches the in-flight write <entry>
+	def _confirmedByStore(self, var, entry):
+		codec = self.cfg.getCodec(var)
+		source = self.cfg.getSubscriptions().get(var)
+		if codec is None or source is None:
+			return False
+		value = self.connection.currentValue(source)
+		return value is not None and self._matches(codec.decode(value), entry[self.EXPECTED], entry[self.TOLERANCE])
+
+	# INTERNAL FUNCTION
+	# Returns the RREF rate the given variable shall be subscribed with. 0 means it is not subscribed at the moment
+	def _rate(self, var):
+		codec = self.cfg.getCodec(var)
+		if var in self.focus:
+			if codec is not None and codec.focus_rate is not None:
+				return codec.focus_rate
+			return self.FOCUS_RATE
+		if codec is not None and codec.rate is not None:
+			return codec.rate
+		return self.DEFAULT_RATE
+
+	# INTERNAL FUNCTION
+	# Subscribes the dataref of the given variable with the rate it should have, if it is not subscribed with it already.
+	# With <force> the subscription is renewed in any case, e.g. to hand it over to the codec of a new profile
+	def _subscribe(self, var, dataref, force=False):
+		codec = self.cfg.getCodec(var)
+		if codec is None:
+			if dataref in self.subscribed:
+				self.connection.unsubscribe(self, dataref)
+				del self.subscribed[dataref]
+			return
+		rate = self._rate(var)
+		if not force and self.subscribed.get(dataref) == var and rate == self.connection.subscribedRate(self, dataref):
+			return
+		self.connection.subscribe(self, var, dataref, codec, self._received if var in self.callbacks else None, rate)
+		if rate > 0:
+			self.subscribed[dataref] = var
+		else:
+			self.subscribed.pop(dataref, None)
+
+	# EXTERNAL FUNCTION
+	# This function will initiate the receiver function by subscribing to the dataref values from the config file.
+	def startReceiver(self, callbacks=None):
+		if callbacks != None:
+			self.callbacks = {}
+			self.setCallbacks(callbacks)
+		for var, dataref in list(self.cfg.getSubscriptions().items()):
+			self._subscribe(var, dataref)
+
+	# EXTERNAL FUNCTION
+	# This function removes all subscriptions of this client
+	def stopReceiver(self):
+		with self.lock:
+			self.inflight.clear()
+		for dataref in list(self.subscribed):
+			self.connection.unsubscribe(self, dataref)
+		self.subscribed.clear()
+
+	# EXTERNAL FUNCTION
+	# This function must be called after the active profile of the configuration has been changed. Only the datarefs which
+	# have been added or removed are requested from x-plane, datarefs which stay subscribed keep their RREF index.
+	def switchProfile(self, callbacks=None):
+		if callbacks != None:
+			self.callbacks = {}
+		# the writes of the old profile are not reconciled with the datarefs of the new one
+		with self.lock:
+			self.inflight.clear()
+		wanted = {dataref: var for var, dataref in self.cfg.getSubscriptions().items()}
+		# unsubscribe the datarefs which are not used by the new profile
+		for dataref in list(self.subscribed):
+			if dataref not in wanted:
+				self.connection.unsubscribe(self, dataref)
+				del self.subscribed[dataref]
+		if callbacks != None:
+			self.setCallbacks(callbacks)
+		for dataref, var in wanted.items():
+			# the codec of the new profile always replaces the old one
+			self._subscribe(var, dataref, True)
+
+	# EXTERNAL FUNCTION
+	# Sets the variables which are shown on the panel. They are subscribed with their focus rate, all others with their
+	# normal rate. Only the subscriptions whose rate changes are requested again.
+	def setFocus(self, variables):
+		focus = set(variables)
+		if focus == self.focus:
+			return
+		changed = focus ^ self.focus
+		self.focus = focus
+		requests = self.cfg.getSubscriptions()
+		for var in changed:
+			if var in requests:
+				self._subscribe(var, requests[var])
+
+	# EXPORTED FUNCTION
+	# Removes all subscriptions of this client from the connection
+	def stop(self):
+		self.stopReceiver()
+		self.connection.disconnect(self)
@@ -0,0 +1,49 @@
+import struct
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from panel.batch import BatchDecoder
+from panel.store import DatarefStore, dataKey
+
+
+# returns a store with <n> datarefs and a batch decoder for it
+def decoder(n=4, key=lambda i: "sim/test/var{}".format(i)):
+	store = DatarefStore()
+	for i in range(n):
+		store.add("var{}".format(i), key(i), None)
+	return store, BatchDecoder(store)
+
+
+def rref(*pairs):
+	packet = bytearray(b"RREF,")
+	for idx, val in pairs:
+		packet += struct.pack("<if", idx, val)
+	return memoryview(packet), len(packet)
+
+
+def test_duplicate_index_keeps_last_value():
+	store, batch = decoder()
+	batch.feed(*rref((1, 5.0), (1, 7.0), (2, 3.0), (1, 9.0)))
+	assert [(idx, raw) for idx, raw, logical in batch.changes()] == [(1, 9.0), (2, 3.0)]
+	assert store.values[1] == 9.0
+
+
+def test_duplicate_index_ending_on_stored_value_is_no_change():
+	store, batch = decoder()
+	batch.feed(*rref((1, 5.0)))
+	batch.changes()
+	batch.feed(*rref((1, 6.0), (1, 5.0)))
+	assert batch.changes() == []
+	assert store.values[1] == 5.0
+
+
+def test_duplicate_data_slot_keeps_last_value():
+	store, batch = decoder(8, lambda i: dataKey(3, i))
+	batch.groups = numpy.vstack([batch.groups, batch.groups[3]])
+	packet = bytearray(b"DATA*")
+	packet += struct.pack("<i8f", 3, *[1.0] * 8)
+	packet += struct.pack("<i8f", 4, *[2.0] * 8)
+	batch.feedData(memoryview(packet), len(packet))
+	assert [raw for idx, raw, logical in batch.changes()] == [2.0] * 8